@@ -0,0 +1,37 @@
+"""Compare the full category list prompt with the token-budgeted one.
+
+Run ``python bench_prompt.py [categories]``. OpenRouter is not called: the
+reported latency is the time to build the prompt locally, and prompt tokens
+are estimated with :func:`prompts.estimate_tokens`.
+"""
+from __future__ import annotations
+
+import random
+import sys
+import timeit
+
+from prompts import FOOTER, HEADER, build_prompt, estimate_tokens
+
+TEXTS = ["потратил 300 на такси", "купил продукты на 1500", "зарплата 80000", "кофе 250"]
+
+
+def full_prompt(text: str, usage: list[tuple[str, int]]) -> str:
+    """Prompt as it was built before: every category, comma-joined."""
+    categories = ", ".join(name for name, _ in usage) or "нет категорий"
+    return HEADER + f"Категории: {categories}.\n" + FOOTER + "\n" + text
+
+
+def main(count: int = 500) -> None:
+    rng = random.Random(0)
+    usage = [(f"Категория {i}", rng.randint(0, 100)) for i in range(count)]
+    usage[:3] = [("Такси", 40), ("Продукты", 90), ("Зарплата", 12)]
+    for name, build in (("full", full_prompt), ("budgeted", build_prompt)):
+        tokens = sum(estimate_tokens(build(text, usage)) for text in TEXTS) / len(TEXTS)
+        runs = 200
+        seconds = timeit.timeit(lambda: [build(text, usage) for text in TEXTS], number=runs)
+        per_prompt_ms = seconds / (runs * len(TEXTS)) * 1000
+        print(f"{name:>9}: {tokens:8.0f} prompt tokens  {per_prompt_ms:7.3f} ms to build")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
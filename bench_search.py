@@ -0,0 +1,61 @@
+"""Measure full-text search over transaction notes on a large ledger.
+
+Run ``python bench_search.py [rows]``. The ledger is generated in a temporary
+SQLite file with notes drawn from a small vocabulary.
+"""
+from __future__ import annotations
+
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from db import connect, create_category, init_db, search_totals, search_transactions
+
+WORDS = ["такси", "обед", "кофе", "продукты", "аптека", "кино", "бензин", "зарплата", "подарок", "метро"]
+QUERIES = ["такси", "кофе", "аптека бензин", "подар", "нетакогослова"]
+
+
+def fill(db_file: Path, rows: int) -> None:
+    rng = random.Random(0)
+    cat_ids = [create_category(name, db_file) for name in ("Еда", "Транспорт", "Разное")]
+    now = datetime.utcnow()
+    with connect(db_file) as conn:
+        conn.executemany(
+            "INSERT INTO transactions(amount, category_id, timestamp, type, note) VALUES (?, ?, ?, ?, ?)",
+            (
+                (
+                    rng.randint(50, 5000),
+                    rng.choice(cat_ids),
+                    (now - timedelta(minutes=rows - i)).isoformat(),
+                    "expense",
+                    " ".join(rng.sample(WORDS, 2)) + f" {i}",
+                )
+                for i in range(rows)
+            ),
+        )
+
+
+def main(rows: int = 300_000) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "bench.db"
+        init_db(db_file)
+        fill(db_file, rows)
+        print(f"{rows} transactions")
+        for query in QUERIES:
+            start = time.perf_counter()
+            page = search_transactions(query, db_path=db_file)
+            page_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            totals = search_totals(query, db_file)
+            totals_ms = (time.perf_counter() - start) * 1000
+            print(
+                f"{query!r:>18}: {totals['count']:7d} matches  "
+                f"page {page_ms:6.2f} ms ({len(page)} rows)  totals {totals_ms:7.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 300_000)
@@ -0,0 +1,84 @@
+"""Measure cold start of the bot entry point.
+
+Run ``python bench_startup.py [runs]``. Every run is a fresh interpreter that
+imports ``telegram_bot``, builds the application against an already migrated
+ledger and answers one ``/start`` update through the fake Bot API from
+``loadtest``. Medians are reported in milliseconds.
+"""
+from __future__ import annotations
+
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CHILD = """
+import asyncio, json, random, sys, time
+from pathlib import Path
+
+start = time.perf_counter()
+import telegram_bot
+imported = time.perf_counter()
+
+from telegram import Update
+from loadtest import FakeTelegram, Upstream
+
+telegram_bot.DB_PATH = Path(sys.argv[1])
+application = telegram_bot.create_application(
+    "0:BENCH", request=FakeTelegram(Upstream(0, 0, random.Random(0)))
+)
+data = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 1, "type": "private"},
+        "from": {"id": 1, "is_bot": False, "first_name": "Bench"},
+        "text": "/start",
+        "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+    },
+}
+
+
+async def first_response():
+    async with application:
+        await application.process_update(Update.de_json(data, application.bot))
+
+
+asyncio.run(first_response())
+answered = time.perf_counter()
+print(json.dumps({
+    "import": (imported - start) * 1000,
+    "first_response": (answered - start) * 1000,
+    "heavy_modules": sorted(m for m in ("llm", "speech", "openai") if m in sys.modules),
+}))
+"""
+
+
+def measure(db_file: Path) -> dict:
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, str(db_file)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(runs: int = 5) -> None:
+    from db import init_db
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "bench.db"
+        init_db(db_file)
+        results = [measure(db_file) for _ in range(runs)]
+    for key in ("import", "first_response"):
+        print(f"{key:>14}: {statistics.median(r[key] for r in results):7.1f} ms")
+    print(f"heavy modules loaded before first reply: {results[0]['heavy_modules'] or 'none'}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+from typing import Any, Callable, Optional
+
+VIRTUAL_NODES = 64
+POLL_TIMEOUT = 30
+POLL_BACKOFF = 1.0
+POLL_BACKOFF_MAX = 60.0
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring mapping chat ids to worker indexes.
+
+    Every worker owns ``replicas`` points on the ring, so changing the number
+    of workers only moves the chats that hash next to the added or removed
+    points.
+    """
+
+    def __init__(self, workers: int, replicas: int = VIRTUAL_NODES) -> None:
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        points = sorted(
+            (_hash(f"worker-{worker}:{replica}"), worker)
+            for worker in range(workers)
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in points]
+        self._workers = [worker for _, worker in points]
+
+    def worker_for(self, key: Any) -> int:
+        """Return the index of the worker responsible for ``key``."""
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._workers[index]
+
+
+def chat_id_of(data: dict) -> Optional[int]:
+    """Return the chat id of a raw Telegram update, or the user id if there is no chat."""
+    for value in data.values():
+        if not isinstance(value, dict):
+            continue
+        if "chat" in value:
+            return value["chat"]["id"]
+        message = value.get("message")
+        if isinstance(message, dict) and "chat" in message:
+            return message["chat"]["id"]
+        if "from" in value:
+            return value["from"]["id"]
+    return None
+
+
+def _worker(token: str, inbox: Any, setup: Optional[Callable] = None, acks: Any = None) -> None:
+    """Process entry point: handle updates from ``inbox`` until ``None`` arrives."""
+    asyncio.run(_serve(token, inbox, setup, acks))
+
+
+async def _serve(
+    token: str, inbox: Any, setup: Optional[Callable] = None, acks: Any = None
+) -> None:
+    """Handle updates from ``inbox``, concurrently across chats and in order within one.
+
+    ``setup`` runs in the worker before the application is built and returns
+    the Bot API transport to use (load tests install fakes this way; prewarm
+    is skipped then). If ``acks`` is given, the worker puts ``None`` on it once
+    ready and ``(update_id, failed)`` after every update.
+    """
+    from telegram import Update
+
+    from telegram_bot import create_application, start_prewarm
+
+    request = setup() if setup is not None else None
+    application = create_application(token, request=request)
+    failed: set[int] = set()
+    if acks is not None:
+
+        async def on_error(update: object, context: Any) -> None:
+            if isinstance(update, Update):
+                failed.add(update.update_id)
+
+        application.add_error_handler(on_error)
+
+    # last task of every chat with updates in flight
+    chats: dict[Any, asyncio.Task] = {}
+
+    async def handle(data: dict, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await application.process_update(Update.de_json(data, application.bot))
+        if acks is not None:
+            update_id = data["update_id"]
+            acks.put((update_id, update_id in failed))
+            failed.discard(update_id)
+
+    def forget(key: Any, task: asyncio.Task) -> None:
+        if chats.get(key) is task:
+            del chats[key]
+
+    async with application:
+        if setup is None:
+            start_prewarm()
+        if acks is not None:
+            acks.put(None)
+        while True:
+            data = await asyncio.to_thread(inbox.get)
+            if data is None:
+                break
+            key = chat_id_of(data)
+            if key is None:
+                key = ("update", data["update_id"])
+            task = asyncio.create_task(handle(data, chats.get(key)))
+            chats[key] = task
+            task.add_done_callback(lambda done, key=key: forget(key, done))
+        if chats:
+            await asyncio.wait(list(chats.values()))
+
+
+class Supervisor:
+    """Poll Telegram once and fan updates out to worker processes by chat id.
+
+    Updates of one chat always reach the same worker, which handles them in
+    order, so per-chat ordering and ``user_data`` stay where they were.
+    """
+
+    def __init__(
+        self,
+        token: str,
+        workers: int,
+        setup: Optional[Callable] = None,
+        acks: Any = None,
+    ) -> None:
+        """``setup`` and ``acks`` are handed to every worker, see :func:`_serve`."""
+        self.token = token
+        self.setup = setup
+        self.acks = acks
+        self.ring = HashRing(workers)
+        self._context = multiprocessing.get_context("spawn")
+        self.queues = [self._context.Queue() for _ in range(workers)]
+        self.processes: list[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+
+    def _spawn(self, index: int) -> None:
+        process = self._context.Process(
+            target=_worker,
+            args=(self.token, self.queues[index], self.setup, self.acks),
+            name=f"bot-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self) -> None:
+        for index in range(len(self.queues)):
+            self._spawn(index)
+
+    def revive(self) -> None:
+        """Restart workers that died; their queued updates are kept."""
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                self._spawn(index)
+
+    def dispatch(self, data: dict) -> int:
+        """Queue a raw update for its chat's worker and return the worker index."""
+        key = chat_id_of(data)
+        index = self.ring.worker_for(data["update_id"] if key is None else key)
+        self.queues[index].put(data)
+        return index
+
+    def stop(self) -> None:
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join()
+
+    async def poll(self) -> None:
+        """Fetch updates forever and dispatch them.
+
+        Network failures and timeouts are retried with exponential backoff
+        (reset after the next successful fetch); flood control waits for the
+        time Telegram asks for.
+        """
+        from telegram import Bot, Update
+        from telegram.error import NetworkError, RetryAfter
+
+        offset = None
+        backoff = POLL_BACKOFF
+        async with Bot(self.token) as bot:
+            while True:
+                try:
+                    updates = await bot.get_updates(
+                        offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES
+                    )
+                except RetryAfter as exc:
+                    logger.warning("Flood control while polling, retrying in %s s", exc.retry_after)
+                    await asyncio.sleep(exc.retry_after)
+                    continue
+                except NetworkError as exc:
+                    logger.warning("Polling failed (%s), retrying in %.0f s", exc, backoff)
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                    continue
+                backoff = POLL_BACKOFF
+                self.revive()
+                for update in updates:
+                    self.dispatch(update.to_dict())
+                    offset = update.update_id + 1
+
+    def run(self) -> None:
+        """Start the workers and poll until interrupted."""
+        self.start()
+        try:
+            asyncio.run(self.poll())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
@@ -1,17 +1,24 @@
 from __future__ import annotations
 
+import re
 import sqlite3
 from contextlib import contextmanager
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Sequence
 
 DB_PATH = Path("finance.db")
+BUSY_TIMEOUT = 30.0
+BUDGET_THRESHOLDS = (0.8, 1.0)
 
 
 @contextmanager
 def connect(db_path: Path = DB_PATH):
-    """Context manager returning a SQLite connection with row factory enabled."""
-    conn = sqlite3.connect(db_path)
+    """Context manager returning a SQLite connection with row factory enabled.
+
+    Writers from other processes are waited for up to ``BUSY_TIMEOUT`` seconds.
+    """
+    conn = sqlite3.connect(db_path, timeout=BUSY_TIMEOUT)
     conn.row_factory = sqlite3.Row
     try:
         yield conn
@@ -20,9 +27,181 @@ def connect(db_path: Path = DB_PATH):
         conn.close()
 
 
+def _add_transaction_notes(conn: sqlite3.Connection) -> None:
+    """Keep the source text of transactions and index it for full-text search."""
+    conn.execute("ALTER TABLE transactions ADD COLUMN note TEXT")
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE transactions_fts USING fts5(
+            note,
+            content='transactions',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    # Index rows that existed before the migration, so delete triggers stay consistent.
+    conn.execute("INSERT INTO transactions_fts(transactions_fts) VALUES ('rebuild')")
+    conn.execute(
+        """
+        CREATE TRIGGER transactions_fts_insert AFTER INSERT ON transactions BEGIN
+            INSERT INTO transactions_fts(rowid, note) VALUES (new.id, new.note);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER transactions_fts_delete AFTER DELETE ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, note) VALUES ('delete', old.id, old.note);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER transactions_fts_update AFTER UPDATE ON transactions BEGIN
+            INSERT INTO transactions_fts(transactions_fts, rowid, note) VALUES ('delete', old.id, old.note);
+            INSERT INTO transactions_fts(rowid, note) VALUES (new.id, new.note);
+        END
+        """
+    )
+
+
+def _add_budgets(conn: sqlite3.Connection) -> None:
+    """Store monthly category limits and keep running monthly expense totals per category."""
+    conn.execute(
+        """
+        CREATE TABLE budgets (
+            category_id INTEGER PRIMARY KEY,
+            monthly_limit REAL NOT NULL,
+            FOREIGN KEY(category_id) REFERENCES categories(id)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE category_spend (
+            category_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            spent REAL NOT NULL,
+            PRIMARY KEY(category_id, month)
+        )
+        """
+    )
+    conn.execute(
+        """
+        INSERT INTO category_spend(category_id, month, spent)
+        SELECT category_id, substr(timestamp, 1, 7), SUM(amount) FROM transactions
+        WHERE type = 'expense' GROUP BY category_id, substr(timestamp, 1, 7)
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_spend_insert AFTER INSERT ON transactions
+        WHEN new.type = 'expense' BEGIN
+            INSERT INTO category_spend(category_id, month, spent)
+            VALUES (new.category_id, substr(new.timestamp, 1, 7), new.amount)
+            ON CONFLICT(category_id, month) DO UPDATE SET spent = spent + excluded.spent;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_spend_delete AFTER DELETE ON transactions
+        WHEN old.type = 'expense' BEGIN
+            UPDATE category_spend SET spent = spent - old.amount
+            WHERE category_id = old.category_id AND month = substr(old.timestamp, 1, 7);
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_spend_update AFTER UPDATE ON transactions BEGIN
+            UPDATE category_spend SET spent = spent - old.amount
+            WHERE old.type = 'expense'
+                AND category_id = old.category_id AND month = substr(old.timestamp, 1, 7);
+            INSERT INTO category_spend(category_id, month, spent)
+            SELECT new.category_id, substr(new.timestamp, 1, 7), new.amount WHERE new.type = 'expense'
+            ON CONFLICT(category_id, month) DO UPDATE SET spent = spent + excluded.spent;
+        END
+        """
+    )
+
+
+def _index_processed_updates(conn: sqlite3.Connection) -> None:
+    """Let start-up load and purge processed updates without scanning the table."""
+    conn.execute("CREATE INDEX processed_updates_processed_at ON processed_updates(processed_at)")
+
+
+def _add_category_uses(conn: sqlite3.Connection) -> None:
+    """Keep a running count of transactions per category for prompt ranking."""
+    conn.execute("ALTER TABLE categories ADD COLUMN uses INTEGER NOT NULL DEFAULT 0")
+    conn.execute("CREATE INDEX transactions_category_id ON transactions(category_id)")
+    conn.execute(
+        """
+        UPDATE categories SET uses = (
+            SELECT COUNT(*) FROM transactions t WHERE t.category_id = categories.id
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_uses_insert AFTER INSERT ON transactions BEGIN
+            UPDATE categories SET uses = uses + 1 WHERE id = new.category_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_uses_delete AFTER DELETE ON transactions BEGIN
+            UPDATE categories SET uses = uses - 1 WHERE id = old.category_id;
+        END
+        """
+    )
+    conn.execute(
+        """
+        CREATE TRIGGER category_uses_update AFTER UPDATE OF category_id ON transactions BEGIN
+            UPDATE categories SET uses = uses - 1 WHERE id = old.category_id;
+            UPDATE categories SET uses = uses + 1 WHERE id = new.category_id;
+        END
+        """
+    )
+
+
+def _note_button_transactions(conn: sqlite3.Connection) -> None:
+    """Make transactions without source text searchable by their category name."""
+    conn.execute(
+        """
+        UPDATE transactions SET note = (
+            SELECT name FROM categories c WHERE c.id = transactions.category_id
+        )
+        WHERE note IS NULL
+        """
+    )
+
+
+# MIGRATIONS[i] upgrades a database from ``PRAGMA user_version`` i to i + 1.
+MIGRATIONS = [
+    _add_transaction_notes,
+    _add_budgets,
+    _index_processed_updates,
+    _add_category_uses,
+    _note_button_transactions,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
 def init_db(db_path: Path = DB_PATH) -> None:
-    """Create tables for categories and transactions if they do not exist."""
+    """Create tables if they do not exist and apply pending schema migrations.
+
+    Returns right away when the database is already at ``SCHEMA_VERSION``.
+    """
     with connect(db_path) as conn:
+        if conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION:
+            return
+        # WAL lets worker processes read while another one writes.
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Lock the database so concurrent workers do not migrate it twice.
+        conn.execute("BEGIN IMMEDIATE")
         conn.execute(
             """
             CREATE TABLE IF NOT EXISTS categories (
@@ -43,23 +222,71 @@ def init_db(db_path: Path = DB_PATH) -> None:
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                key TEXT PRIMARY KEY,
+                reply TEXT NOT NULL,
+                processed_at TEXT NOT NULL
+            )
+            """
+        )
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for migrate in MIGRATIONS[version:]:
+            migrate(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
 
-def create_category(name: str, db_path: Path = DB_PATH) -> int:
+def _mark_processed(conn: sqlite3.Connection, keys: Sequence[str]) -> None:
+    """Record update keys in the caller's transaction, so a write and its dedupe record commit together."""
+    now = datetime.utcnow().isoformat()
+    conn.executemany(
+        "INSERT OR REPLACE INTO processed_updates(key, reply, processed_at) VALUES (?, '', ?)",
+        [(key, now) for key in keys],
+    )
+
+
+def create_category(name: str, db_path: Path = DB_PATH, processed_keys: Sequence[str] = ()) -> int:
     """Insert a new category and return its id."""
     with connect(db_path) as conn:
         cur = conn.execute("INSERT INTO categories(name) VALUES (?)", (name,))
+        _mark_processed(conn, processed_keys)
         return cur.lastrowid
 
 
-def update_category(category_id: int, name: str, db_path: Path = DB_PATH) -> None:
+def ensure_category(name: str, db_path: Path = DB_PATH) -> int:
+    """Return the id of the category ``name``, creating it if it does not exist.
+
+    Safe when several workers create the same category at once.
+    """
     with connect(db_path) as conn:
+        conn.execute("INSERT OR IGNORE INTO categories(name) VALUES (?)", (name,))
+        return conn.execute("SELECT id FROM categories WHERE name=?", (name,)).fetchone()["id"]
+
+
+def update_category(
+    category_id: int, name: str, db_path: Path = DB_PATH, processed_keys: Sequence[str] = ()
+) -> None:
+    """Rename a category; button-entered transactions noted by its old name follow it."""
+    with connect(db_path) as conn:
+        row = conn.execute("SELECT name FROM categories WHERE id=?", (category_id,)).fetchone()
         conn.execute("UPDATE categories SET name=? WHERE id=?", (name, category_id))
+        if row is not None:
+            conn.execute(
+                "UPDATE transactions SET note=? WHERE category_id=? AND note=?",
+                (name, category_id, row["name"]),
+            )
+        _mark_processed(conn, processed_keys)
 
 
-def delete_category(category_id: int, db_path: Path = DB_PATH) -> None:
+def delete_category(
+    category_id: int, db_path: Path = DB_PATH, processed_keys: Sequence[str] = ()
+) -> None:
     with connect(db_path) as conn:
+        _mark_processed(conn, processed_keys)
         conn.execute("DELETE FROM transactions WHERE category_id=?", (category_id,))
+        conn.execute("DELETE FROM budgets WHERE category_id=?", (category_id,))
+        conn.execute("DELETE FROM category_spend WHERE category_id=?", (category_id,))
         conn.execute("DELETE FROM categories WHERE id=?", (category_id,))
 
 
@@ -68,27 +295,105 @@ def list_categories(db_path: Path = DB_PATH) -> list[sqlite3.Row]:
         return conn.execute("SELECT id, name FROM categories ORDER BY id").fetchall()
 
 
+def list_category_usage(db_path: Path = DB_PATH) -> list[sqlite3.Row]:
+    """Return categories with the number of transactions recorded in each."""
+    with connect(db_path) as conn:
+        return conn.execute("SELECT id, name, uses FROM categories ORDER BY id").fetchall()
+
+
 def add_transaction(
     amount: float,
     category_id: int,
     type: str,
     timestamp: datetime | None = None,
     db_path: Path = DB_PATH,
+    note: str | None = None,
+    alerts: list[dict] | None = None,
+    processed_keys: Sequence[str] = (),
 ) -> int:
-    """Add a transaction and purge records older than six months."""
+    """Add a transaction and purge records older than six months.
+
+    ``note`` keeps the user's original text and is indexed for :func:`search_transactions`.
+    If ``alerts`` is given, a dict with ``category``, ``threshold``, ``spent`` and
+    ``limit`` is appended when the expense crosses a share of the category's
+    monthly limit listed in ``BUDGET_THRESHOLDS``. ``processed_keys`` are the
+    Telegram update keys recorded in the same transaction as the operation.
+    """
     if type not in {"expense", "income"}:
         raise ValueError("type must be 'expense' or 'income'")
     ts = timestamp or datetime.utcnow()
     with connect(db_path) as conn:
         cur = conn.execute(
-            "INSERT INTO transactions(amount, category_id, timestamp, type) VALUES (?, ?, ?, ?)",
-            (amount, category_id, ts.isoformat(), type),
+            "INSERT INTO transactions(amount, category_id, timestamp, type, note) VALUES (?, ?, ?, ?, ?)",
+            (amount, category_id, ts.isoformat(), type, note),
         )
+        _mark_processed(conn, processed_keys)
+        if type == "expense" and alerts is not None:
+            alerts.extend(_budget_alerts(conn, category_id, ts.strftime("%Y-%m"), amount))
         cutoff = datetime.utcnow() - timedelta(days=180)
         conn.execute("DELETE FROM transactions WHERE timestamp < ?", (cutoff.isoformat(),))
+        conn.execute("DELETE FROM category_spend WHERE month < ?", (cutoff.strftime("%Y-%m"),))
         return cur.lastrowid
 
 
+def _budget_alerts(conn: sqlite3.Connection, category_id: int, month: str, amount: float) -> list[dict]:
+    """Return the highest budget threshold crossed by the expense just inserted, if any."""
+    row = conn.execute(
+        (
+            "SELECT s.spent, b.monthly_limit, c.name FROM category_spend s "
+            "JOIN budgets b ON b.category_id = s.category_id "
+            "JOIN categories c ON c.id = s.category_id "
+            "WHERE s.category_id = ? AND s.month = ?"
+        ),
+        (category_id, month),
+    ).fetchone()
+    if row is None:
+        return []
+    spent, limit = row["spent"], row["monthly_limit"]
+    crossed = [t for t in BUDGET_THRESHOLDS if spent - amount < t * limit <= spent]
+    if not crossed:
+        return []
+    return [{"category": row["name"], "threshold": crossed[-1], "spent": spent, "limit": limit}]
+
+
+def set_budget(
+    category_id: int,
+    monthly_limit: float,
+    db_path: Path = DB_PATH,
+    processed_keys: Sequence[str] = (),
+    alerts: list[dict] | None = None,
+) -> None:
+    """Set the monthly spending limit of a category; a limit of zero or less removes it.
+
+    If ``alerts`` is given, the highest threshold this month's spend has
+    already reached under the new limit is appended (see :func:`add_transaction`),
+    since later expenses only report thresholds they cross themselves.
+    """
+    with connect(db_path) as conn:
+        _mark_processed(conn, processed_keys)
+        if monthly_limit <= 0:
+            conn.execute("DELETE FROM budgets WHERE category_id=?", (category_id,))
+            return
+        conn.execute(
+            "INSERT OR REPLACE INTO budgets(category_id, monthly_limit) VALUES (?, ?)",
+            (category_id, monthly_limit),
+        )
+        if alerts is not None:
+            # Count the whole month's spend as new, so every reached threshold qualifies.
+            month = datetime.utcnow().strftime("%Y-%m")
+            alerts.extend(_budget_alerts(conn, category_id, month, float("inf")))
+
+
+def get_category_spend(category_id: int, year: int, month: int, db_path: Path = DB_PATH) -> float:
+    """Return the running expense total of a category for the specified month."""
+    with connect(db_path) as conn:
+        row = conn.execute(
+            "SELECT spent FROM category_spend WHERE category_id=? AND month=?",
+            (category_id, f"{year}-{month:02d}"),
+        ).fetchone()
+        return float(row["spent"]) if row else 0.0
+
+
 def get_transactions_for_month(year: int, month: int, db_path: Path = DB_PATH) -> list[sqlite3.Row]:
     """Return transactions with category names for the specified month."""
     start = datetime(year, month, 1)
@@ -104,6 +409,52 @@ def get_transactions_for_month(year: int, month: int, db_path: Path = DB_PATH) -
         ).fetchall()
 
 
+def _match_query(text: str) -> str:
+    """Turn free user text into an FTS5 query matching every word as a prefix."""
+    return " ".join(f'"{word}"*' for word in re.findall(r"\w+", text.lower()))
+
+
+def search_transactions(
+    query: str,
+    limit: int = 10,
+    offset: int = 0,
+    db_path: Path = DB_PATH,
+) -> list[sqlite3.Row]:
+    """Return transactions whose note matches ``query``, newest first."""
+    match = _match_query(query)
+    if not match:
+        return []
+    with connect(db_path) as conn:
+        return conn.execute(
+            (
+                "SELECT t.id, t.amount, t.timestamp, t.type, t.note, c.name as category "
+                "FROM (SELECT rowid FROM transactions_fts WHERE transactions_fts MATCH ? "
+                "ORDER BY rowid DESC LIMIT ? OFFSET ?) f "
+                "JOIN transactions t ON t.id = f.rowid "
+                "JOIN categories c ON t.category_id = c.id ORDER BY t.id DESC"
+            ),
+            (match, limit, offset),
+        ).fetchall()
+
+
+def search_totals(query: str, db_path: Path = DB_PATH) -> sqlite3.Row | None:
+    """Return count, income and expense sums of transactions matching ``query``."""
+    match = _match_query(query)
+    if not match:
+        return None
+    with connect(db_path) as conn:
+        return conn.execute(
+            (
+                "SELECT COUNT(*) as count, "
+                "COALESCE(SUM(CASE WHEN t.type='income' THEN t.amount ELSE 0 END), 0) as income, "
+                "COALESCE(SUM(CASE WHEN t.type='expense' THEN t.amount ELSE 0 END), 0) as expense "
+                "FROM transactions_fts f JOIN transactions t ON t.id = f.rowid "
+                "WHERE transactions_fts MATCH ?"
+            ),
+            (match,),
+        ).fetchone()
+
+
 def get_balance(db_path: Path = DB_PATH) -> float:
     """Return current balance: incomes minus expenses."""
     with connect(db_path) as conn:
@@ -111,3 +462,22 @@ def get_balance(db_path: Path = DB_PATH) -> float:
             "SELECT COALESCE(SUM(CASE WHEN type='income' THEN amount ELSE -amount END), 0) as balance FROM transactions"
         ).fetchone()
         return float(row["balance"])
+
+
+def purge_processed_updates(before: datetime, db_path: Path = DB_PATH) -> None:
+    """Delete processed update keys recorded before ``before``."""
+    with connect(db_path) as conn:
+        conn.execute("DELETE FROM processed_updates WHERE processed_at < ?", (before.isoformat(),))
+
+
+def load_processed_updates(since: datetime, limit: int, db_path: Path = DB_PATH) -> list[sqlite3.Row]:
+    """Return the most recent processed updates newer than ``since``, oldest first."""
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            (
+                "SELECT key, reply, processed_at FROM processed_updates "
+                "WHERE processed_at >= ? ORDER BY processed_at DESC LIMIT ?"
+            ),
+            (since.isoformat(), limit),
+        ).fetchall()
+    return rows[::-1]
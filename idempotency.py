@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+from db import DB_PATH, load_processed_updates, purge_processed_updates
+
+DEFAULT_TTL = timedelta(hours=24)
+DEFAULT_MAX_SIZE = 10_000
+DEFAULT_PURGE_INTERVAL = timedelta(hours=1)
+# Reply for updates recorded before a restart: SQLite keeps only their keys.
+RECORDED_REPLY = "Уже записано ✅"
+
+
+def update_keys(update: Any) -> list[str]:
+    """Return idempotency keys for a Telegram update.
+
+    Telegram redelivers the same ``update_id`` after a polling restart or a
+    webhook retry; the chat/message pair catches the same message arriving in a
+    different update.
+    """
+    keys = [f"update:{update.update_id}"]
+    message = update.message
+    if message is not None:
+        keys.append(f"message:{message.chat_id}:{message.message_id}")
+    return keys
+
+
+class ProcessedUpdates:
+    """Bounded, TTL-evicted memory of replies sent for already handled updates.
+
+    Lookups only touch an in-memory ``OrderedDict``. The keys themselves are
+    written to SQLite by the ledger write they belong to (``processed_keys`` in
+    :mod:`db`), read back on start-up, and expired rows are purged on start-up
+    and by :meth:`purge_expired`.
+    """
+
+    def __init__(
+        self,
+        db_path: Path = DB_PATH,
+        max_size: int = DEFAULT_MAX_SIZE,
+        ttl: timedelta = DEFAULT_TTL,
+        purge_interval: timedelta = DEFAULT_PURGE_INTERVAL,
+    ) -> None:
+        self.db_path = db_path
+        self.max_size = max_size
+        self.ttl = ttl
+        self.purge_interval = purge_interval
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._load()
+
+    def _load(self) -> None:
+        now = datetime.utcnow()
+        self._purge()
+        for row in load_processed_updates(now - self.ttl, self.max_size, self.db_path):
+            age = (now - datetime.fromisoformat(row["processed_at"])).total_seconds()
+            self._store(row["key"], row["reply"] or RECORDED_REPLY, time.monotonic() - age)
+
+    def _purge(self) -> None:
+        purge_processed_updates(datetime.utcnow() - self.ttl, self.db_path)
+        self._purged_at = time.monotonic()
+
+    def _store(self, key: str, reply: str, stamp: float) -> None:
+        self._entries[key] = (reply, stamp)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, keys: list[str]) -> Optional[str]:
+        """Return the stored reply for any of ``keys`` or ``None`` if unseen or expired."""
+        for key in keys:
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            reply, stamp = entry
+            if time.monotonic() - stamp > self.ttl.total_seconds():
+                del self._entries[key]
+                continue
+            return reply
+        return None
+
+    def remember(self, keys: list[str], reply: str) -> None:
+        """Store ``reply`` for ``keys`` in memory; the keys must already be committed with the write."""
+        stamp = time.monotonic()
+        for key in keys:
+            self._store(key, reply, stamp)
+
+    def purge_expired(self) -> None:
+        """Delete expired keys from SQLite if the last purge is ``purge_interval`` old.
+
+        Blocks on the database, so callers on the event loop run it in a thread.
+        """
+        if time.monotonic() - self._purged_at >= self.purge_interval.total_seconds():
+            self._purge()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,56 +1,231 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import time
+import weakref
 from pathlib import Path
+from typing import Awaitable, Callable, Sequence
 
 import httpx
 
-from db import DB_PATH, add_transaction, create_category, list_categories
+from db import (
+    DB_PATH,
+    add_transaction,
+    ensure_category,
+    list_category_usage,
+)
+from prompts import build_prompt
 
 OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
 MODEL = "deepseek/deepseek-r1-0528:free"
+FAST_MODEL = "meta-llama/llama-3.3-70b-instruct:free"
+MODELS = [
+    name.strip()
+    for name in os.environ.get("OPENROUTER_MODELS", f"{MODEL},{FAST_MODEL}").split(",")
+    if name.strip()
+]
+LATENCY_BUDGET = float(os.environ.get("OPENROUTER_LATENCY_BUDGET", "8"))
+REQUEST_TIMEOUT = 30
 
 
-def classify_and_add(text: str, db_path: Path = DB_PATH) -> dict:
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _client() -> httpx.AsyncClient:
+    """HTTP client of the running event loop, so requests reuse pooled connections to OpenRouter."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+    return client
+
+
+async def _post(url: str, **kwargs) -> httpx.Response:
+    return await _client().post(url, **kwargs)
+
+
+async def prewarm() -> None:
+    """Open a pooled connection to OpenRouter before the first classification."""
+    try:
+        await _client().head(OPENROUTER_URL)
+    except httpx.HTTPError:
+        pass
+
+
+class ModelStats:
+    """Running latency and success statistics of one model."""
+
+    ALPHA = 0.3
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.successes = 0
+        self.latency: float | None = None
+
+    def record(self, latency: float, ok: bool) -> None:
+        self.calls += 1
+        if not ok:
+            return
+        self.successes += 1
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = self.ALPHA * latency + (1 - self.ALPHA) * self.latency
+
+    def record_cancelled(self, elapsed: float) -> None:
+        """Count a request cancelled after ``elapsed`` seconds as failed; it took at least that long."""
+        self.calls += 1
+        bound = max(elapsed, self.latency or 0.0)
+        if self.latency is None:
+            self.latency = bound
+        else:
+            self.latency = self.ALPHA * bound + (1 - self.ALPHA) * self.latency
+
+    def expected_latency(self, prior: float) -> float:
+        """Average latency divided by success rate; ``prior`` for untried models."""
+        if not self.calls:
+            return prior
+        if not self.successes:
+            return float("inf")
+        return (self.latency or prior) * self.calls / self.successes
+
+
+class ModelRouter:
+    """Send a request to the best model and hedge with the next one when it is slow.
+
+    Models are tried in the order of their expected latency (configured order
+    until they have stats). If no valid answer arrives within ``budget``
+    seconds, or a model fails, the next model is asked as well and the first
+    valid answer wins.
+    """
+
+    def __init__(self, models: list[str], budget: float = LATENCY_BUDGET) -> None:
+        if not models:
+            raise ValueError("at least one model is required")
+        self.models = list(models)
+        self.budget = budget
+        self.stats = {model: ModelStats() for model in self.models}
+
+    def ordered(self) -> list[str]:
+        return sorted(self.models, key=lambda m: self.stats[m].expected_latency(self.budget))
+
+    async def _timed(self, call: Callable[[str], Awaitable[dict]], model: str) -> dict:
+        start = time.monotonic()
+        try:
+            result = await call(model)
+        except asyncio.CancelledError:
+            self.stats[model].record_cancelled(time.monotonic() - start)
+            raise
+        except Exception:
+            self.stats[model].record(time.monotonic() - start, False)
+            raise
+        self.stats[model].record(time.monotonic() - start, True)
+        return result
+
+    async def run(self, call: Callable[[str], Awaitable[dict]]) -> dict:
+        """Return the first result of ``call(model)`` that does not raise.
+
+        Requests still running when a winner arrives are cancelled, which
+        closes their connections, and count as failures in the losers' stats.
+        """
+        queue = self.ordered()
+        pending: dict[asyncio.Task, str] = {}
+        error: Exception | None = None
+
+        def launch() -> None:
+            model = queue.pop(0)
+            pending[asyncio.create_task(self._timed(call, model))] = model
+
+        launch()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending,
+                    timeout=self.budget if queue else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    launch()
+                    continue
+                for task in done:
+                    del pending[task]
+                    try:
+                        return task.result()
+                    except Exception as exc:
+                        error = exc
+                if queue and not pending:
+                    launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        assert error is not None
+        raise error
+
+
+router = ModelRouter(MODELS)
+
+
+def _parse_result(content: str) -> dict:
+    """Validate the model's JSON answer; raise ``ValueError`` if it is unusable."""
+    result = json.loads(content)
+    if result.get("type") not in {"expense", "income"}:
+        raise ValueError(f"unexpected operation type: {result.get('type')!r}")
+    category = str(result.get("category") or "").strip()
+    if not category:
+        raise ValueError("category is missing")
+    return {"category": category, "amount": float(result["amount"]), "type": result["type"]}
+
+
+async def classify_and_add(
+    text: str, db_path: Path = DB_PATH, processed_keys: Sequence[str] = ()
+) -> dict:
     """Use OpenRouter to classify text and record the transaction.
 
-    Returns a dict with keys ``category``, ``amount`` and ``type``.
+    Returns a dict with keys ``category``, ``amount``, ``type`` and ``alerts``,
+    the budget thresholds the operation crossed (see :func:`db.add_transaction`).
     """
-    categories = [row["name"] for row in list_categories(db_path)]
-    prompt = (
-        "Определи тип операции (expense или income), сумму и категорию для текста пользователя.\n"
-        f"Категории: {', '.join(categories) if categories else 'нет категорий'}.\n"
-        "Если подходящей категории нет, предложи новую.\n"
-        "Ответь JSON с ключами: type, amount, category."
-    )
+    usage = await asyncio.to_thread(list_category_usage, db_path)
+    prompt = build_prompt(text, [(row["name"], row["uses"]) for row in usage])
 
     headers = {
         "Authorization": f"Bearer {os.environ['OPENROUTER_API_KEY']}",
         "HTTP-Referer": os.environ.get("OPENROUTER_SITE_URL", "http://localhost"),
         "X-Title": os.environ.get("OPENROUTER_APP", "ExpenseBot"),
     }
-    data = {
-        "model": MODEL,
-        "response_format": {"type": "json_object"},
-        "messages": [
-            {"role": "user", "content": prompt + "\n" + text}
-        ],
-    }
-    resp = httpx.post(OPENROUTER_URL, headers=headers, json=data, timeout=30)
-    resp.raise_for_status()
-    content = resp.json()["choices"][0]["message"]["content"]
-    result = json.loads(content)
 
+    async def ask(model: str) -> dict:
+        data = {
+            "model": model,
+            "response_format": {"type": "json_object"},
+            "messages": [
+                {"role": "user", "content": prompt}
+            ],
+        }
+        resp = await _post(OPENROUTER_URL, headers=headers, json=data, timeout=REQUEST_TIMEOUT)
+        resp.raise_for_status()
+        content = resp.json()["choices"][0]["message"]["content"]
+        return _parse_result(content)
+
+    result = await router.run(ask)
     category = result["category"]
-    amount = float(result["amount"])
+    amount = result["amount"]
     tx_type = result["type"]
 
-    existing = {row["name"]: row["id"] for row in list_categories(db_path)}
-    if category not in existing:
-        cat_id = create_category(category, db_path)
-    else:
-        cat_id = existing[category]
+    cat_id = await asyncio.to_thread(ensure_category, category, db_path)
 
-    add_transaction(amount, cat_id, tx_type, db_path=db_path)
-    return {"category": category, "amount": amount, "type": tx_type}
+    alerts: list[dict] = []
+    await asyncio.to_thread(
+        add_transaction,
+        amount,
+        cat_id,
+        tx_type,
+        db_path=db_path,
+        note=text,
+        alerts=alerts,
+        processed_keys=processed_keys,
+    )
+    return {"category": category, "amount": amount, "type": tx_type, "alerts": alerts}
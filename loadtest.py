@@ -0,0 +1,485 @@
+"""Replay scripted chat sessions against the bot with fake upstream services.
+
+Run ``python loadtest.py --users 2000 --sessions 5000 --rate 200``. Telegram,
+OpenRouter and the transcription API are replaced in-process by fakes with
+tunable latency and error rates, the ledger lives in a temporary SQLite file,
+and the report lists offered and achieved rates, per-flow step latency
+percentiles measured from when each step was due, and error rates.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Optional
+
+from telegram import Update
+from telegram.request import BaseRequest
+
+import db
+import telegram_bot
+
+TEXTS = [
+    ("такси до дома 300", "Транспорт", "expense", 300),
+    ("обед 450", "Еда", "expense", 450),
+    ("кофе 200", "Еда", "expense", 200),
+    ("зарплата 80000", "Зарплата", "income", 80000),
+    ("кино 600", "Развлечения", "expense", 600),
+]
+# Every step is the text a user sends and a pattern one of the bot's replies must match.
+FLOWS = {
+    "income": [("Добавить доход 💰", "категорию дохода"), ("Зарплата", "Сколько"), ("50000", "Готово!")],
+    "expense": [("Добавить расход 💸", "категорию расхода"), ("Еда", "Сколько"), ("350", "Готово!")],
+    "free_text": [("{text}", "записано ✅")],
+    "voice": [("{voice}", "записано ✅")],
+    "report": [("Отчёт за месяц 📅", "Выбери месяц"), ("{month}", "Итог|Транзакций нет")],
+    "balance": [("Показать баланс 📊", "Сейчас")],
+    "search": [("Поиск 🔍", "Что ищем"), ("такси", "Найдено|Ничего не нашлось")],
+}
+DEFAULT_MIX = {
+    "income": 1,
+    "expense": 4,
+    "free_text": 4,
+    "voice": 2,
+    "report": 1,
+    "balance": 2,
+    "search": 1,
+}
+CATEGORIES = ["Еда", "Транспорт", "Зарплата", "Развлечения"]
+
+# FakeOpenRouter.__call__ must take a ``json`` keyword like ``llm._post``.
+_json_dumps = json.dumps
+
+
+def _delay(rng: random.Random, latency: float) -> float:
+    """Latency with ±50% jitter."""
+    return latency * rng.uniform(0.5, 1.5) if latency > 0 else 0.0
+
+
+class Upstream:
+    """Latency, error rate and call counters of one fake endpoint."""
+
+    def __init__(self, latency: float, error_rate: float, rng: random.Random) -> None:
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = rng
+        self.calls = 0
+        self.errors = 0
+
+    def roll(self) -> tuple[float, bool]:
+        """Count a call and return its delay and whether it fails."""
+        self.calls += 1
+        failed = self.rng.random() < self.error_rate
+        self.errors += failed
+        return _delay(self.rng, self.latency), failed
+
+
+class FakeTelegram(BaseRequest):
+    """In-process Bot API answering every method the bot uses.
+
+    Texts of sent messages are collected in ``replies`` by chat id, or put on
+    ``sink`` as ``("reply", chat_id, text)`` when the fake runs in a cluster worker.
+    """
+
+    def __init__(self, upstream: Upstream, sink: Any = None) -> None:
+        self.upstream = upstream
+        self.sink = sink
+        self.replies: dict[int, list[str]] = defaultdict(list)
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _result(self, method: str, params: dict) -> Any:
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Load", "username": "load_bot"}
+        if method == "getFile":
+            return {"file_id": params["file_id"], "file_unique_id": "voice", "file_path": "voice/1.ogg"}
+        if method == "sendMessage":
+            chat_id, text = int(params["chat_id"]), params["text"]
+            if self.sink is not None:
+                self.sink.put(("reply", chat_id, text))
+            else:
+                self.replies[chat_id].append(text)
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(params.get("chat_id", 0)), "type": "private"},
+            "text": params.get("text", ""),
+        }
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Any = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> tuple[int, bytes]:
+        delay, failed = self.upstream.roll()
+        await asyncio.sleep(delay)
+        if failed:
+            return 502, b'{"ok": false, "error_code": 502, "description": "Bad Gateway"}'
+        if "/file/bot" in url:
+            return 200, b"OggS"
+        params = request_data.parameters if request_data is not None else {}
+        body = {"ok": True, "result": self._result(url.rsplit("/", 1)[-1], params)}
+        return 200, json.dumps(body).encode()
+
+
+class FakeOpenRouter:
+    """Stand-in for ``llm._post`` to OpenRouter."""
+
+    def __init__(self, upstream: Upstream) -> None:
+        self.upstream = upstream
+
+    async def __call__(
+        self, url: str, headers: Any = None, json: Any = None, timeout: Any = None
+    ) -> Any:
+        delay, failed = self.upstream.roll()
+        await asyncio.sleep(delay)
+        text = json["messages"][-1]["content"].rsplit("\n", 1)[-1]
+        _, category, tx_type, amount = next((t for t in TEXTS if t[0] == text), TEXTS[0])
+        content = _json_dumps({"category": category, "type": tx_type, "amount": amount})
+
+        class Resp:
+            def raise_for_status(self) -> None:
+                if failed:
+                    raise RuntimeError("OpenRouter returned 503")
+
+            def json(self) -> dict:
+                return {"choices": [{"message": {"content": content}}]}
+
+        return Resp()
+
+
+class FakeTranscriber:
+    """Stand-in for ``speech.transcribe`` returning one of the scripted texts."""
+
+    def __init__(self, upstream: Upstream) -> None:
+        self.upstream = upstream
+
+    async def __call__(self, path: str) -> str:
+        delay, failed = self.upstream.roll()
+        await asyncio.sleep(delay)
+        if failed:
+            raise RuntimeError("transcription failed")
+        return self.upstream.rng.choice(TEXTS)[0]
+
+
+class WorkerFakes:
+    """Cluster worker ``setup`` (see :func:`cluster._serve`) installing the fakes in the worker."""
+
+    def __init__(
+        self, db_file: Path, upstreams: dict[str, tuple[float, float]], seed: int, sink: Any
+    ) -> None:
+        self.db_file = db_file
+        self.upstreams = upstreams
+        self.seed = seed
+        self.sink = sink
+
+    def _upstream(self, name: str) -> Upstream:
+        latency, error_rate = self.upstreams[name]
+        return Upstream(latency, error_rate, random.Random(f"{self.seed}:{os.getpid()}:{name}"))
+
+    def __call__(self) -> BaseRequest:
+        import llm
+
+        telegram_bot.DB_PATH = self.db_file
+        telegram_bot.transcribe = FakeTranscriber(self._upstream("transcription"))
+        llm._post = FakeOpenRouter(self._upstream("openrouter"))
+        os.environ.setdefault("OPENROUTER_API_KEY", "load-test")
+        return FakeTelegram(self._upstream("telegram"), self.sink)
+
+
+def _update(update_id: int, chat_id: int, step: str, rng: random.Random) -> dict:
+    message: dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+        "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+    }
+    if step == "{voice}":
+        message["voice"] = {"file_id": f"voice-{update_id}", "file_unique_id": "voice", "duration": 2}
+    elif step == "{text}":
+        message["text"] = rng.choice(TEXTS)[0]
+    elif step == "{month}":
+        message["text"] = datetime.utcnow().strftime("%Y-%m")
+    else:
+        message["text"] = step
+    return {"update_id": update_id, "message": message}
+
+
+def percentile(values: list[float], share: float) -> float:
+    """Nearest-rank percentile of ``values``; 0 when there are none."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(share * len(ordered)) - 1))]
+
+
+def _plan(
+    sessions: int, rate: float, users: int, mix: dict[str, float], rng: random.Random
+) -> list[tuple[float, str, int]]:
+    """Arrival offset, flow and user of every session, fixed before the run starts."""
+    flows = list(mix)
+    weights = [mix[f] for f in flows]
+    plan = []
+    offset = 0.0
+    for _ in range(sessions):
+        plan.append((offset, rng.choices(flows, weights)[0], rng.randrange(users)))
+        offset += rng.expovariate(rate)
+    return plan
+
+
+async def _replay(
+    plan: list[tuple[float, str, int]],
+    users: int,
+    think: float,
+    send: Callable[[dict], Awaitable[tuple[bool, list[str]]]],
+    rng: random.Random,
+) -> dict:
+    """Send every session's steps and measure each from the time it was due.
+
+    ``send`` returns whether a handler failed and the texts the bot replied;
+    a step also counts as an error when no reply matches its expected pattern.
+
+    A session is due at its planned arrival, and every later step is due one
+    think time after the previous reply. Time spent waiting for the user's
+    previous session, in a stalled event loop or in a queue counts towards
+    latency, so queueing is not hidden (no coordinated omission).
+    """
+    latencies: dict[str, list[float]] = defaultdict(list)
+    errors: dict[str, int] = defaultdict(int)
+    locks = [asyncio.Lock() for _ in range(users)]
+    counter = iter(range(1, 10**9))
+    began = time.monotonic()
+
+    async def session(arrival: float, flow: str, user: int) -> None:
+        due = began + arrival
+        await asyncio.sleep(max(0.0, due - time.monotonic()))
+        async with locks[user]:
+            for step, expected in FLOWS[flow]:
+                failed, replies = await send(_update(next(counter), 10_000 + user, step, rng))
+                answered = time.monotonic()
+                latencies[flow].append(answered - due)
+                errors[flow] += failed or not any(re.search(expected, r) for r in replies)
+                due = answered + _delay(rng, think)
+                await asyncio.sleep(max(0.0, due - time.monotonic()))
+
+    await asyncio.gather(*(session(*entry) for entry in plan))
+    elapsed = time.monotonic() - began
+    span = plan[-1][0] if len(plan) > 1 else 0.0
+    steps = sum(len(v) for v in latencies.values())
+    return {
+        "elapsed": elapsed,
+        "sessions": len(plan),
+        "steps": steps,
+        "offered_rate": len(plan) / span if span else 0.0,
+        "achieved_rate": len(plan) / elapsed if elapsed else 0.0,
+        "throughput": steps / elapsed if elapsed else 0.0,
+        "flows": {
+            flow: {
+                "steps": len(values),
+                "errors": errors[flow],
+                "error_rate": errors[flow] / len(values),
+                "p50": percentile(values, 0.5),
+                "p95": percentile(values, 0.95),
+                "p99": percentile(values, 0.99),
+            }
+            for flow, values in sorted(latencies.items())
+        },
+    }
+
+
+async def _replay_cluster(
+    plan: list[tuple[float, str, int]],
+    users: int,
+    think: float,
+    workers: int,
+    db_file: Path,
+    upstreams: dict[str, tuple[float, float]],
+    seed: int,
+) -> dict:
+    """Replay ``plan`` through :class:`cluster.Supervisor` and ``workers`` worker processes.
+
+    Workers put their replies and update acks on one queue, so every reply
+    arrives before the ack of the update that sent it.
+    """
+    from cluster import Supervisor
+
+    acks = multiprocessing.get_context("spawn").Queue()
+    setup = WorkerFakes(db_file, upstreams, seed, acks)
+    supervisor = Supervisor("0:LOAD", workers, setup=setup, acks=acks)
+    supervisor.start()
+    try:
+        for _ in range(workers):
+            await asyncio.to_thread(acks.get, timeout=120)
+        loop = asyncio.get_running_loop()
+        waiting: dict[int, asyncio.Future] = {}
+        replies: dict[int, list[str]] = defaultdict(list)
+
+        async def collect() -> None:
+            while (ack := await asyncio.to_thread(acks.get)) is not None:
+                if ack[0] == "reply":
+                    replies[ack[1]].append(ack[2])
+                    continue
+                update_id, failed = ack
+                waiting.pop(update_id).set_result(failed)
+
+        async def send(data: dict) -> tuple[bool, list[str]]:
+            waiting[data["update_id"]] = future = loop.create_future()
+            supervisor.dispatch(data)
+            failed = await future
+            return failed, replies.pop(data["message"]["chat"]["id"], [])
+
+        collector = asyncio.create_task(collect())
+        try:
+            return await _replay(plan, users, think, send, random.Random(seed + 4))
+        finally:
+            acks.put(None)
+            await collector
+    finally:
+        await asyncio.to_thread(supervisor.stop)
+
+
+async def run_load(
+    users: int = 100,
+    sessions: int = 500,
+    rate: float = 50.0,
+    think: float = 0.0,
+    mix: Optional[dict[str, float]] = None,
+    telegram_latency: float = 0.05,
+    telegram_errors: float = 0.0,
+    llm_latency: float = 0.5,
+    llm_errors: float = 0.0,
+    stt_latency: float = 0.3,
+    stt_errors: float = 0.0,
+    seed: int = 0,
+    workers: int = 0,
+) -> dict:
+    """Replay ``sessions`` sessions arriving at ``rate`` per second and return the report.
+
+    With ``workers`` the updates go through :class:`cluster.Supervisor` to that
+    many worker processes, each with its own fakes; upstream call counts are
+    then not reported.
+    """
+    import llm
+
+    plan = _plan(sessions, rate, users, mix or DEFAULT_MIX, random.Random(seed))
+    if workers:
+        upstreams = {
+            "telegram": (telegram_latency, telegram_errors),
+            "openrouter": (llm_latency, llm_errors),
+            "transcription": (stt_latency, stt_errors),
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            db_file = Path(tmp) / "load.db"
+            db.init_db(db_file)
+            for name in CATEGORIES:
+                db.create_category(name, db_file)
+            return await _replay_cluster(plan, users, think, workers, db_file, upstreams, seed)
+
+    telegram = Upstream(telegram_latency, telegram_errors, random.Random(seed + 1))
+    openrouter = Upstream(llm_latency, llm_errors, random.Random(seed + 2))
+    stt = Upstream(stt_latency, stt_errors, random.Random(seed + 3))
+    failed_updates: set[int] = set()
+
+    saved = (telegram_bot.DB_PATH, telegram_bot.transcribe, llm._post, llm.router)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = Path(tmp) / "load.db"
+        telegram_bot.DB_PATH = db_file
+        telegram_bot.transcribe = FakeTranscriber(stt)
+        llm._post = FakeOpenRouter(openrouter)
+        llm.router = llm.ModelRouter(llm.MODELS)
+        os.environ.setdefault("OPENROUTER_API_KEY", "load-test")
+        try:
+            db.init_db(db_file)
+            for name in CATEGORIES:
+                db.create_category(name, db_file)
+            fake_telegram = FakeTelegram(telegram)
+            application = telegram_bot.create_application("0:LOAD", request=fake_telegram)
+
+            async def on_error(update: object, context: Any) -> None:
+                if isinstance(update, Update):
+                    failed_updates.add(update.update_id)
+
+            application.add_error_handler(on_error)
+
+            async def send(data: dict) -> tuple[bool, list[str]]:
+                # Go through the update processor like run_polling does, so the
+                # default of one update at a time applies here too.
+                update = Update.de_json(data, application.bot)
+                await application.update_processor.process_update(
+                    update, application.process_update(update)
+                )
+                replies = fake_telegram.replies.pop(data["message"]["chat"]["id"], [])
+                return data["update_id"] in failed_updates, replies
+
+            async with application:
+                report = await _replay(plan, users, think, send, random.Random(seed + 4))
+        finally:
+            telegram_bot.DB_PATH, telegram_bot.transcribe, llm._post, llm.router = saved
+
+    report["upstream"] = {
+        name: {"calls": up.calls, "errors": up.errors}
+        for name, up in (("telegram", telegram), ("openrouter", openrouter), ("transcription", stt))
+    }
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"{report['sessions']} sessions, {report['steps']} updates in {report['elapsed']:.2f} s",
+        f"offered {report['offered_rate']:.1f} sessions/s, achieved {report['achieved_rate']:.1f} "
+        f"sessions/s ({report['throughput']:.1f} updates/s)",
+        f"{'flow':>10} {'updates':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}",
+    ]
+    for flow, row in report["flows"].items():
+        lines.append(
+            f"{flow:>10} {row['steps']:8d} {row['error_rate']:7.1%} "
+            f"{row['p50'] * 1000:8.1f} {row['p95'] * 1000:8.1f} {row['p99'] * 1000:8.1f}"
+        )
+    for name, row in report.get("upstream", {}).items():
+        lines.append(f"{name:>13}: {row['calls']} calls, {row['errors']} injected errors")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--sessions", type=int, default=500)
+    parser.add_argument("--rate", type=float, default=50.0, help="new sessions per second")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds between a user's steps")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--telegram-errors", type=float, default=0.0)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-errors", type=float, default=0.0)
+    parser.add_argument("--stt-latency", type=float, default=0.3)
+    parser.add_argument("--stt-errors", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=0, help="run the bot in this many cluster worker processes"
+    )
+    args = parser.parse_args(argv)
+    report = asyncio.run(run_load(**vars(args)))
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
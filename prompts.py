@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import heapq
+from functools import lru_cache
+from typing import Iterable
+
+TOKEN_BUDGET = 300
+TOP_K = 15
+USAGE_WEIGHT = 0.25
+
+HEADER = "Определи тип операции (expense или income), сумму и категорию для текста пользователя.\n"
+FOOTER = (
+    "Если подходящей категории нет, предложи новую.\n"
+    "Ответь JSON с ключами: type, amount, category."
+)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate: roughly four UTF-8 bytes per token."""
+    return len(text.encode()) // 4 + 1
+
+
+@lru_cache(maxsize=4096)
+def _trigrams(text: str) -> frozenset[str]:
+    padded = f"  {text.lower()} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def rank_categories(text: str, usage: Iterable[tuple[str, int]], k: int = TOP_K) -> list[str]:
+    """Return up to ``k`` category names most relevant to ``text``.
+
+    A category scores the share of its name's character trigrams found in the
+    text plus a bonus for how often it was used, so when nothing matches the
+    most used categories come first.
+    """
+    usage = list(usage)
+    if not usage:
+        return []
+    grams = _trigrams(text)
+    top_uses = max(uses for _, uses in usage) or 1
+    scored = []
+    for index, (name, uses) in enumerate(usage):
+        name_grams = _trigrams(name)
+        similarity = len(grams & name_grams) / len(name_grams)
+        scored.append((similarity + USAGE_WEIGHT * uses / top_uses, -index, name))
+    return [name for _, _, name in heapq.nlargest(k, scored)]
+
+
+def build_prompt(
+    text: str,
+    usage: Iterable[tuple[str, int]],
+    budget: int = TOKEN_BUDGET,
+    k: int = TOP_K,
+) -> str:
+    """Build the classification prompt, listing as many relevant categories as fit in ``budget`` tokens."""
+    ranked = rank_categories(text, usage, k)
+    chosen: list[str] = []
+    size = estimate_tokens(HEADER + "Категории: .\n" + FOOTER + "\n" + text)
+    for name in ranked:
+        cost = estimate_tokens(", " + name)
+        if size + cost > budget:
+            break
+        chosen.append(name)
+        size += cost
+    categories = ", ".join(chosen) if chosen else "нет категорий"
+    return HEADER + f"Категории: {categories}.\n" + FOOTER + "\n" + text
@@ -1,11 +1,25 @@
 import asyncio
 import os
+from functools import lru_cache
+
 from openai import OpenAI
 
 
+@lru_cache(maxsize=None)
+def _client() -> OpenAI:
+    """Shared OpenAI client, so transcriptions reuse pooled connections."""
+    return OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+
+def prewarm() -> None:
+    """Build the OpenAI client ahead of the first voice message."""
+    if "OPENAI_API_KEY" in os.environ:
+        _client()
+
+
 async def transcribe(path: str) -> str:
     """Transcribe audio file at ``path`` using Whisper (turbo)."""
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+    client = _client()
     with open(path, "rb") as f:
         resp = await asyncio.to_thread(
             client.audio.transcriptions.create,
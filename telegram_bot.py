@@ -1,7 +1,9 @@
+import asyncio
 import os
 import tempfile
 from datetime import datetime
-from typing import Optional
+from pathlib import Path
+from typing import Optional, Sequence
 
 from telegram import ReplyKeyboardMarkup, Update
 from telegram.ext import (
@@ -12,6 +14,7 @@ from telegram.ext import (
     MessageHandler,
     filters,
 )
+from telegram.request import BaseRequest
 
 from bot import Bot
 from db import (
@@ -19,14 +22,17 @@ from db import (
     add_transaction,
     create_category,
     delete_category,
+    ensure_category,
     get_balance,
     get_transactions_for_month,
     init_db,
     list_categories,
+    search_totals,
+    search_transactions,
+    set_budget,
     update_category,
 )
-from llm import classify_and_add
-from speech import transcribe
+from idempotency import ProcessedUpdates, update_keys
 
 
 MAIN_KEYBOARD = ReplyKeyboardMarkup(
@@ -34,19 +40,112 @@ MAIN_KEYBOARD = ReplyKeyboardMarkup(
         ["Добавить доход 💰", "Добавить расход 💸"],
         ["Показать баланс 📊", "Отчёт за месяц 📅"],
         ["Создать категорию ➕", "Переименовать категорию ✏️"],
-        ["Удалить категорию 🗑️", "Помощь ❓"],
+        ["Удалить категорию 🗑️", "Поиск 🔍"],
+        ["Лимит категории 🎯", "Помощь ❓"],
     ],
     resize_keyboard=True,
 )
 
+SEARCH_PAGE = 10
+MORE_BUTTON = "Ещё ➡️"
+MORE_KEYBOARD = ReplyKeyboardMarkup([[MORE_BUTTON], ["Меню 🏠"]], resize_keyboard=True)
 
-def create_application(token: Optional[str] = None) -> Application:
-    """Create a Telegram application using the provided token or `TELEGRAM_TOKEN` env var."""
+
+async def classify_and_add(
+    text: str, db_path: Path = DB_PATH, processed_keys: Sequence[str] = ()
+) -> dict:
+    """Classify and record ``text``; ``llm`` is imported on first use."""
+    from llm import classify_and_add as classify
+
+    return await classify(text, db_path, processed_keys)
+
+
+async def transcribe(path: str) -> str:
+    """Transcribe a voice message; ``speech`` and the OpenAI SDK are imported on first use."""
+    from speech import transcribe as whisper
+
+    return await whisper(path)
+
+
+def _load_integrations() -> None:
+    import llm  # noqa: F401
+    import speech
+
+    speech.prewarm()
+
+
+async def prewarm() -> None:
+    """Import the LLM and speech integrations off the event loop and open their upstream connections."""
+    await asyncio.to_thread(_load_integrations)
+    import llm
+
+    await llm.prewarm()
+
+
+_prewarm_tasks: set[asyncio.Task] = set()
+
+
+def start_prewarm() -> asyncio.Task:
+    """Run :func:`prewarm` in the background so startup does not wait for it."""
+    task = asyncio.get_running_loop().create_task(prewarm())
+    _prewarm_tasks.add(task)
+    task.add_done_callback(_prewarm_tasks.discard)
+    return task
+
+
+async def _prewarm_after_init(application: Application) -> None:
+    start_prewarm()
+
+
+def format_alert(alert: dict) -> str:
+    """Describe a crossed category budget threshold."""
+    icon = "🚨" if alert["threshold"] >= 1 else "⚠️"
+    return (
+        f"{icon} {alert['category']}: {alert['threshold']:.0%} лимита "
+        f"({alert['spent']:.2f} из {alert['limit']:.2f} ₽)"
+    )
+
+
+def recorded_reply(result: dict) -> str:
+    """Confirm an operation recorded from free text, with any budget alerts it caused."""
+    lines = [f"{result['amount']:.2f} ₽ в категории {result['category']} записано ✅"]
+    lines += [format_alert(a) for a in result.get("alerts", [])]
+    return "\n".join(lines)
+
+
+def create_application(
+    token: Optional[str] = None, request: Optional[BaseRequest] = None
+) -> Application:
+    """Create a Telegram application using the provided token or `TELEGRAM_TOKEN` env var.
+
+    ``request`` replaces the HTTP transport to the Bot API, e.g. with a fake in load tests.
+    """
     if token is None:
         token = os.environ["TELEGRAM_TOKEN"]
     init_db(DB_PATH)
-    application = ApplicationBuilder().token(token).build()
+    builder = ApplicationBuilder().token(token).post_init(_prewarm_after_init)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
     convo = Bot()
+    processed = ProcessedUpdates(DB_PATH)
+
+    async def replay(update: Update) -> bool:
+        """Answer a redelivered update with its stored reply instead of handling it again."""
+        reply = processed.get(update_keys(update))
+        if reply is None:
+            return False
+        await update.message.reply_text(reply, reply_markup=MAIN_KEYBOARD)
+        return True
+
+    async def done(update: Update, text: str) -> None:
+        """Reply after a write and remember the reply so redeliveries are not recorded twice.
+
+        The update keys were committed together with the write itself.
+        """
+        processed.remember(update_keys(update), text)
+        await update.message.reply_text(text, reply_markup=MAIN_KEYBOARD)
+        await asyncio.to_thread(processed.purge_expired)
 
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         await update.message.reply_text(
@@ -54,11 +153,40 @@ def create_application(token: Optional[str] = None) -> Application:
             reply_markup=MAIN_KEYBOARD,
         )
 
+    async def send_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        query = context.user_data["query"]
+        offset = context.user_data.get("offset", 0)
+        rows = await asyncio.to_thread(search_transactions, query, SEARCH_PAGE + 1, offset, DB_PATH)
+        if not rows:
+            context.user_data.clear()
+            await update.message.reply_text("Ничего не нашлось 🤷", reply_markup=MAIN_KEYBOARD)
+            return
+        lines = []
+        if offset == 0:
+            totals = await asyncio.to_thread(search_totals, query, DB_PATH)
+            lines.append(
+                f"Найдено: {totals['count']}, расходы: {totals['expense']:.2f} ₽, "
+                f"доходы: {totals['income']:.2f} ₽"
+            )
+        for r in rows[:SEARCH_PAGE]:
+            sign = -r["amount"] if r["type"] == "expense" else r["amount"]
+            lines.append(f"{r['timestamp'][:10]} {r['category']}: {sign:+.2f} ₽ — {r['note']}")
+        msg = "\n".join(lines)
+        if len(rows) > SEARCH_PAGE:
+            context.user_data["step"] = "search_more"
+            context.user_data["offset"] = offset + SEARCH_PAGE
+            await update.message.reply_text(msg, reply_markup=MORE_KEYBOARD)
+        else:
+            context.user_data.clear()
+            await update.message.reply_text(msg, reply_markup=MAIN_KEYBOARD)
+
     async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if await replay(update):
+            return
         text = update.message.text
 
         if context.user_data.get("step") == "category":
-            categories = {row["name"]: row["id"] for row in list_categories(DB_PATH)}
+            categories = {row["name"]: row["id"] for row in await asyncio.to_thread(list_categories, DB_PATH)}
             cat_id = categories.get(text)
             if cat_id is None:
                 keyboard = ReplyKeyboardMarkup([[name] for name in categories], resize_keyboard=True)
@@ -67,6 +195,7 @@ def create_application(token: Optional[str] = None) -> Application:
                 )
                 return
             context.user_data["category_id"] = cat_id
+            context.user_data["category"] = text
             context.user_data["step"] = "amount"
             await update.message.reply_text("Сколько? 💵")
             return
@@ -77,17 +206,22 @@ def create_application(token: Optional[str] = None) -> Application:
             except ValueError:
                 await update.message.reply_text("Нужна цифра, попробуй ещё раз 🙂")
                 return
-            add_transaction(
+            alerts: list[dict] = []
+            await asyncio.to_thread(
+                add_transaction,
                 amount,
                 context.user_data["category_id"],
                 context.user_data["type"],
                 db_path=DB_PATH,
+                # Button entries have no free text; the category name keeps them searchable.
+                note=context.user_data["category"],
+                alerts=alerts,
+                processed_keys=update_keys(update),
             )
             context.user_data.clear()
-            balance = get_balance(DB_PATH)
-            await update.message.reply_text(
-                f"Готово! Баланс: {balance:.2f} ₽", reply_markup=MAIN_KEYBOARD
-            )
+            balance = await asyncio.to_thread(get_balance, DB_PATH)
+            lines = [f"Готово! Баланс: {balance:.2f} ₽"] + [format_alert(a) for a in alerts]
+            await done(update, "\n".join(lines))
             return
 
         if context.user_data.get("step") == "report":
@@ -98,7 +232,7 @@ def create_application(token: Optional[str] = None) -> Application:
                     "Выбери месяц из списка 🙏",
                 )
                 return
-            rows = get_transactions_for_month(year, month, DB_PATH)
+            rows = await asyncio.to_thread(get_transactions_for_month, year, month, DB_PATH)
             if not rows:
                 msg = "Транзакций нет 📭"
             else:
@@ -116,16 +250,26 @@ def create_application(token: Optional[str] = None) -> Application:
             await update.message.reply_text(msg, reply_markup=MAIN_KEYBOARD)
             return
 
+        if context.user_data.get("step") == "search":
+            context.user_data["query"] = text
+            await send_search_page(update, context)
+            return
+
+        if context.user_data.get("step") == "search_more":
+            if text == MORE_BUTTON:
+                await send_search_page(update, context)
+                return
+            # Anything else ends the search and is handled as a regular message.
+            context.user_data.clear()
+
         if context.user_data.get("step") == "new_category":
-            create_category(text, DB_PATH)
+            await asyncio.to_thread(create_category, text, DB_PATH, update_keys(update))
             context.user_data.clear()
-            await update.message.reply_text(
-                f"Категория '{text}' добавлена ✅", reply_markup=MAIN_KEYBOARD
-            )
+            await done(update, f"Категория '{text}' добавлена ✅")
             return
 
         if context.user_data.get("step") == "rename_select":
-            categories = {row["name"]: row["id"] for row in list_categories(DB_PATH)}
+            categories = {row["name"]: row["id"] for row in await asyncio.to_thread(list_categories, DB_PATH)}
             cat_id = categories.get(text)
             if cat_id is None:
                 keyboard = ReplyKeyboardMarkup([[name] for name in categories], resize_keyboard=True)
@@ -139,15 +283,47 @@ def create_application(token: Optional[str] = None) -> Application:
             return
 
         if context.user_data.get("step") == "rename_name":
-            update_category(context.user_data["cat_id"], text, DB_PATH)
+            await asyncio.to_thread(
+                update_category, context.user_data["cat_id"], text, DB_PATH, update_keys(update)
+            )
             context.user_data.clear()
-            await update.message.reply_text(
-                "Категория обновлена ✅", reply_markup=MAIN_KEYBOARD
+            await done(update, "Категория обновлена ✅")
+            return
+
+        if context.user_data.get("step") == "budget_select":
+            categories = {row["name"]: row["id"] for row in await asyncio.to_thread(list_categories, DB_PATH)}
+            cat_id = categories.get(text)
+            if cat_id is None:
+                keyboard = ReplyKeyboardMarkup([[name] for name in categories], resize_keyboard=True)
+                await update.message.reply_text(
+                    "Выбери категорию из списка 🗂", reply_markup=keyboard
+                )
+                return
+            context.user_data["cat_id"] = cat_id
+            context.user_data["step"] = "budget_amount"
+            await update.message.reply_text("Лимит в месяц? 0 — убрать 🎯")
+            return
+
+        if context.user_data.get("step") == "budget_amount":
+            try:
+                limit = float(text.replace(",", "."))
+            except ValueError:
+                await update.message.reply_text("Нужна цифра, попробуй ещё раз 🙂")
+                return
+            alerts = []
+            await asyncio.to_thread(
+                set_budget, context.user_data["cat_id"], limit, DB_PATH, update_keys(update), alerts
             )
+            context.user_data.clear()
+            if limit > 0:
+                lines = [f"Лимит {limit:.2f} ₽ в месяц сохранён ✅"] + [format_alert(a) for a in alerts]
+                await done(update, "\n".join(lines))
+            else:
+                await done(update, "Лимит убран ✅")
             return
 
         if context.user_data.get("step") == "delete_select":
-            categories = {row["name"]: row["id"] for row in list_categories(DB_PATH)}
+            categories = {row["name"]: row["id"] for row in await asyncio.to_thread(list_categories, DB_PATH)}
             cat_id = categories.get(text)
             if cat_id is None:
                 keyboard = ReplyKeyboardMarkup([[name] for name in categories], resize_keyboard=True)
@@ -155,20 +331,18 @@ def create_application(token: Optional[str] = None) -> Application:
                     "Выбери категорию из списка 🗂", reply_markup=keyboard
                 )
                 return
-            delete_category(cat_id, DB_PATH)
+            await asyncio.to_thread(delete_category, cat_id, DB_PATH, update_keys(update))
             context.user_data.clear()
-            await update.message.reply_text(
-                "Категория удалена 🗑️", reply_markup=MAIN_KEYBOARD
-            )
+            await done(update, "Категория удалена 🗑️")
             return
 
         if text == "Добавить доход 💰":
             context.user_data["type"] = "income"
             context.user_data["step"] = "category"
-            categories = list_categories(DB_PATH)
+            categories = await asyncio.to_thread(list_categories, DB_PATH)
             if not categories:
-                create_category("Общее", DB_PATH)
-                categories = list_categories(DB_PATH)
+                await asyncio.to_thread(ensure_category, "Общее", DB_PATH)
+                categories = await asyncio.to_thread(list_categories, DB_PATH)
             keyboard = ReplyKeyboardMarkup([[c["name"]] for c in categories], resize_keyboard=True)
             await update.message.reply_text(
                 "Выбери категорию дохода 💰", reply_markup=keyboard
@@ -178,10 +352,10 @@ def create_application(token: Optional[str] = None) -> Application:
         if text == "Добавить расход 💸":
             context.user_data["type"] = "expense"
             context.user_data["step"] = "category"
-            categories = list_categories(DB_PATH)
+            categories = await asyncio.to_thread(list_categories, DB_PATH)
             if not categories:
-                create_category("Общее", DB_PATH)
-                categories = list_categories(DB_PATH)
+                await asyncio.to_thread(ensure_category, "Общее", DB_PATH)
+                categories = await asyncio.to_thread(list_categories, DB_PATH)
             keyboard = ReplyKeyboardMarkup([[c["name"]] for c in categories], resize_keyboard=True)
             await update.message.reply_text(
                 "Выбери категорию расхода 💸", reply_markup=keyboard
@@ -189,7 +363,7 @@ def create_application(token: Optional[str] = None) -> Application:
             return
 
         if text == "Показать баланс 📊":
-            balance = get_balance(DB_PATH)
+            balance = await asyncio.to_thread(get_balance, DB_PATH)
             await update.message.reply_text(
                 f"Сейчас: {balance:.2f} ₽", reply_markup=MAIN_KEYBOARD
             )
@@ -212,13 +386,22 @@ def create_application(token: Optional[str] = None) -> Application:
             )
             return
 
+        if text == "Поиск 🔍":
+            context.user_data["step"] = "search"
+            await update.message.reply_text("Что ищем? Например: такси 🔍")
+            return
+
+        if text == "Меню 🏠":
+            await update.message.reply_text("Выбери действие 😊", reply_markup=MAIN_KEYBOARD)
+            return
+
         if text == "Создать категорию ➕":
             context.user_data["step"] = "new_category"
             await update.message.reply_text("Название категории? 📝")
             return
 
         if text == "Переименовать категорию ✏️":
-            categories = list_categories(DB_PATH)
+            categories = await asyncio.to_thread(list_categories, DB_PATH)
             if not categories:
                 await update.message.reply_text(
                     "Категорий нет 👀", reply_markup=MAIN_KEYBOARD
@@ -234,7 +417,7 @@ def create_application(token: Optional[str] = None) -> Application:
             return
 
         if text == "Удалить категорию 🗑️":
-            categories = list_categories(DB_PATH)
+            categories = await asyncio.to_thread(list_categories, DB_PATH)
             if not categories:
                 await update.message.reply_text(
                     "Категорий нет 👀", reply_markup=MAIN_KEYBOARD
@@ -249,39 +432,51 @@ def create_application(token: Optional[str] = None) -> Application:
             )
             return
 
+        if text == "Лимит категории 🎯":
+            categories = await asyncio.to_thread(list_categories, DB_PATH)
+            if not categories:
+                await update.message.reply_text(
+                    "Категорий нет 👀", reply_markup=MAIN_KEYBOARD
+                )
+                return
+            context.user_data["step"] = "budget_select"
+            keyboard = ReplyKeyboardMarkup(
+                [[c["name"]] for c in categories], resize_keyboard=True
+            )
+            await update.message.reply_text(
+                "Для какой категории? 🗂", reply_markup=keyboard
+            )
+            return
+
         if text == "Помощь ❓":
             await update.message.reply_text(
                 "Нажми нужную кнопку: доход, расход или баланс. 🤝"
             )
             return
         try:
-            result = classify_and_add(text, DB_PATH)
+            result = await classify_and_add(text, DB_PATH, update_keys(update))
         except Exception:
             response = convo.respond(text)
             await update.message.reply_text(response)
         else:
-            await update.message.reply_text(
-                f"{result['amount']:.2f} ₽ в категории {result['category']} записано ✅",
-                reply_markup=MAIN_KEYBOARD,
-            )
+            await done(update, recorded_reply(result))
 
     async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Transcribe voice message and process like free text."""
+        if await replay(update):
+            return
         voice = update.message.voice
         file = await voice.get_file()
         with tempfile.NamedTemporaryFile(suffix=".ogg") as tmp:
             await file.download_to_drive(tmp.name)
             text = await transcribe(tmp.name)
         try:
-            result = classify_and_add(text, DB_PATH)
+            result = await classify_and_add(text, DB_PATH, update_keys(update))
         except Exception:
             response = convo.respond(text)
             await update.message.reply_text(response)
         else:
-            await update.message.reply_text(
-                f"{result['amount']:.2f} ₽ в категории {result['category']} записано ✅",
-                reply_markup=MAIN_KEYBOARD,
-            )
+            await done(update, recorded_reply(result))
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
@@ -290,6 +485,12 @@ def create_application(token: Optional[str] = None) -> Application:
 
 
 def main() -> None:
+    workers = int(os.environ.get("BOT_WORKERS", "1"))
+    if workers > 1:
+        from cluster import Supervisor
+
+        Supervisor(os.environ["TELEGRAM_TOKEN"], workers).run()
+        return
     app = create_application()
     app.run_polling()
 
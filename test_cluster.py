@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+import telegram
+from telegram import Update
+from telegram.error import NetworkError, RetryAfter, TimedOut
+
+import cluster
+from cluster import HashRing, Supervisor, chat_id_of
+
+
+def test_hash_ring_is_stable_and_spread():
+    ring = HashRing(4)
+    assignments = [ring.worker_for(chat) for chat in range(1000)]
+    assert assignments == [HashRing(4).worker_for(chat) for chat in range(1000)]
+    assert set(assignments) == {0, 1, 2, 3}
+    assert min(assignments.count(w) for w in range(4)) > 100
+
+
+def test_hash_ring_moves_few_chats_when_scaling():
+    before = HashRing(4)
+    after = HashRing(5)
+    moved = sum(before.worker_for(c) != after.worker_for(c) for c in range(1000))
+    assert moved < 400
+
+
+def test_chat_id_of():
+    assert chat_id_of({"update_id": 1, "message": {"chat": {"id": 5}}}) == 5
+    assert chat_id_of({"update_id": 2, "callback_query": {"from": {"id": 6}, "message": {"chat": {"id": 7}}}}) == 7
+    assert chat_id_of({"update_id": 3, "inline_query": {"from": {"id": 8}}}) == 8
+    assert chat_id_of({"update_id": 4}) is None
+
+
+def test_dispatch_keeps_chat_affinity():
+    supervisor = Supervisor("TOKEN123", 3)
+    first = supervisor.dispatch({"update_id": 1, "message": {"chat": {"id": 42}, "text": "a"}})
+    second = supervisor.dispatch({"update_id": 2, "message": {"chat": {"id": 42}, "text": "b"}})
+    assert first == second
+    queue = supervisor.queues[first]
+    assert [queue.get(timeout=1)["update_id"], queue.get(timeout=1)["update_id"]] == [1, 2]
+
+
+def test_poll_keeps_going_after_network_errors(monkeypatch):
+    class Stop(Exception):
+        pass
+
+    message = {"message_id": 1, "date": 0, "chat": {"id": 42, "type": "private"}, "text": "a"}
+    update = Update.de_json({"update_id": 7, "message": message}, None)
+    answers = [TimedOut(), NetworkError("boom"), RetryAfter(3), [update], NetworkError("again"), Stop()]
+
+    class FakeBot:
+        def __init__(self, token):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc):
+            pass
+
+        async def get_updates(self, **kwargs):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+    sleeps = []
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+
+    monkeypatch.setattr(telegram, "Bot", FakeBot)
+    monkeypatch.setattr(cluster.asyncio, "sleep", fake_sleep)
+    supervisor = Supervisor("TOKEN123", 1)
+    with pytest.raises(Stop):
+        asyncio.run(supervisor.poll())
+    # backoff doubles, flood control waits as asked, success resets the backoff
+    assert sleeps == [cluster.POLL_BACKOFF, cluster.POLL_BACKOFF * 2, 3, cluster.POLL_BACKOFF]
+    assert supervisor.queues[0].get(timeout=1)["update_id"] == 7
@@ -1,15 +1,23 @@
 from datetime import datetime, timedelta
 from pathlib import Path
+import sqlite3
 
 from db import (
     add_transaction,
     create_category,
     delete_category,
+    ensure_category,
     get_transactions_for_month,
     init_db,
     list_categories,
+    list_category_usage,
     update_category,
     get_balance,
+    search_totals,
+    search_transactions,
+    set_budget,
+    get_category_spend,
+    SCHEMA_VERSION,
 )
 
 
@@ -29,6 +37,17 @@ def test_category_crud(tmp_path):
     assert list_categories(db_file) == []
 
 
+def test_ensure_category_is_idempotent(tmp_path):
+    db_file = tmp_path / "test.db"
+    init_db(db_file)
+    cat_id = create_category("Food", db_file)
+    # another worker created "Food" after this one listed the categories
+    assert ensure_category("Food", db_file) == cat_id
+    taxi = ensure_category("Taxi", db_file)
+    assert ensure_category("Taxi", db_file) == taxi
+    assert [row["name"] for row in list_categories(db_file)] == ["Food", "Taxi"]
+
+
 def test_transactions_and_purge(tmp_path):
     db_file = tmp_path / "test.db"
     init_db(db_file)
@@ -56,3 +75,124 @@ def test_get_balance(tmp_path):
     add_transaction(100.0, cat_id, "income", db_path=db_file)
     add_transaction(40.0, cat_id, "expense", db_path=db_file)
     assert get_balance(db_file) == 60.0
+
+
+def test_search_transactions(tmp_path):
+    db_file = tmp_path / "test.db"
+    init_db(db_file)
+    taxi = create_category("Транспорт", db_file)
+    food = create_category("Еда", db_file)
+    add_transaction(300.0, taxi, "expense", db_path=db_file, note="Такси до дома 300")
+    add_transaction(450.0, taxi, "expense", db_path=db_file, note="такси в аэропорт")
+    add_transaction(200.0, food, "expense", db_path=db_file, note="обед")
+    add_transaction(1000.0, food, "income", db_path=db_file)
+
+    rows = search_transactions("такси", db_path=db_file)
+    assert [r["amount"] for r in rows] == [450.0, 300.0]
+    assert rows[0]["category"] == "Транспорт"
+    assert [r["amount"] for r in search_transactions("такс", limit=1, offset=1, db_path=db_file)] == [300.0]
+
+    totals = search_totals("такси", db_file)
+    assert totals["count"] == 2 and totals["expense"] == 750.0 and totals["income"] == 0
+
+    delete_category(taxi, db_file)
+    assert search_transactions("такси", db_path=db_file) == []
+    assert search_transactions("!!!", db_path=db_file) == []
+
+
+def test_renamed_category_stays_searchable(tmp_path):
+    db_file = tmp_path / "test.db"
+    init_db(db_file)
+    cat_id = create_category("Salary", db_file)
+    # a button entry is noted by its category name, a free-text one keeps its text
+    add_transaction(100.0, cat_id, "income", db_path=db_file, note="Salary")
+    add_transaction(50.0, cat_id, "income", db_path=db_file, note="salary bonus")
+
+    update_category(cat_id, "Зарплата", db_file)
+    rows = search_transactions("Зарплата", db_path=db_file)
+    assert [(r["amount"], r["note"]) for r in rows] == [(100.0, "Зарплата")]
+    assert [r["note"] for r in search_transactions("salary", db_path=db_file)] == ["salary bonus"]
+
+
+def test_init_db_migrates_old_schema(tmp_path):
+    db_file = tmp_path / "old.db"
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE categories (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL)")
+    conn.execute(
+        "CREATE TABLE transactions (id INTEGER PRIMARY KEY AUTOINCREMENT, amount REAL NOT NULL, "
+        "category_id INTEGER NOT NULL, timestamp TEXT NOT NULL, type TEXT NOT NULL)"
+    )
+    conn.execute("INSERT INTO categories(name) VALUES ('Bills')")
+    conn.execute(
+        "INSERT INTO transactions(amount, category_id, timestamp, type) VALUES (10, 1, ?, 'expense')",
+        (datetime.utcnow().isoformat(),),
+    )
+    conn.commit()
+    conn.close()
+
+    init_db(db_file)
+    init_db(db_file)
+    assert search_transactions("bills", db_path=db_file)[0]["amount"] == 10.0
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    conn.close()
+    add_transaction(5.0, 1, "expense", db_path=db_file, note="свет")
+    assert get_balance(db_file) == -15.0
+    assert len(search_transactions("свет", db_path=db_file)) == 1
+    delete_category(1, db_file)
+    assert search_transactions("свет", db_path=db_file) == []
+
+
+def test_budget_alerts_and_running_spend(tmp_path):
+    db_file = tmp_path / "test.db"
+    init_db(db_file)
+    cat_id = create_category("Еда", db_file)
+    other = create_category("Кино", db_file)
+    set_budget(cat_id, 1000.0, db_file)
+    now = datetime.utcnow()
+
+    alerts = []
+    add_transaction(700.0, cat_id, "expense", db_path=db_file, alerts=alerts)
+    add_transaction(500.0, other, "expense", db_path=db_file, alerts=alerts)
+    add_transaction(500.0, cat_id, "income", db_path=db_file, alerts=alerts)
+    assert alerts == []
+
+    add_transaction(150.0, cat_id, "expense", db_path=db_file, alerts=alerts)
+    assert alerts == [{"category": "Еда", "threshold": 0.8, "spent": 850.0, "limit": 1000.0}]
+
+    alerts.clear()
+    add_transaction(100.0, cat_id, "expense", db_path=db_file, alerts=alerts)
+    assert alerts == []
+    add_transaction(100.0, cat_id, "expense", db_path=db_file, alerts=alerts)
+    assert [a["threshold"] for a in alerts] == [1.0]
+    assert get_category_spend(cat_id, now.year, now.month, db_file) == 1050.0
+
+    set_budget(cat_id, 0, db_file)
+    alerts.clear()
+    add_transaction(5000.0, cat_id, "expense", db_path=db_file, alerts=alerts)
+    assert alerts == []
+
+    # a limit set below this month's spend reports the state right away
+    alerts.clear()
+    set_budget(cat_id, 5000.0, db_file, alerts=alerts)
+    assert alerts == [{"category": "Еда", "threshold": 1.0, "spent": 6050.0, "limit": 5000.0}]
+    alerts.clear()
+    set_budget(cat_id, 10000.0, db_file, alerts=alerts)
+    assert alerts == []
+
+    delete_category(other, db_file)
+    assert get_category_spend(other, now.year, now.month, db_file) == 0.0
+
+
+def test_category_usage_counter(tmp_path):
+    db_file = tmp_path / "test.db"
+    init_db(db_file)
+    food = create_category("Еда", db_file)
+    taxi = create_category("Такси", db_file)
+    for _ in range(3):
+        add_transaction(10.0, food, "expense", db_path=db_file)
+    add_transaction(10.0, taxi, "expense", db_path=db_file)
+    add_transaction(10.0, taxi, "expense", timestamp=datetime.utcnow() - timedelta(days=200), db_path=db_file)
+
+    assert [(r["name"], r["uses"]) for r in list_category_usage(db_file)] == [("Еда", 3), ("Такси", 1)]
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import db
+from idempotency import RECORDED_REPLY, ProcessedUpdates, update_keys
+
+
+def test_remember_and_replay(tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    processed = ProcessedUpdates(db_file)
+
+    assert processed.get(["update:1"]) is None
+    processed.remember(["update:1", "message:5:7"], "Готово!")
+    assert processed.get(["update:1"]) == "Готово!"
+    assert processed.get(["update:2", "message:5:7"]) == "Готово!"
+
+
+def test_keys_committed_with_the_write_survive_restart(tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    cat_id = db.create_category("Food", db_file)
+    # the process dies before the reply is remembered in memory
+    db.add_transaction(10.0, cat_id, "expense", db_path=db_file, processed_keys=["update:1"])
+
+    restarted = ProcessedUpdates(db_file)
+    assert restarted.get(["update:1"]) == RECORDED_REPLY
+    assert restarted.get(["update:2"]) is None
+
+
+def test_bounded_and_expiring(tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    processed = ProcessedUpdates(db_file, max_size=2)
+    for i in range(3):
+        processed.remember([f"update:{i}"], str(i))
+    assert len(processed) == 2
+    assert processed.get(["update:0"]) is None
+    assert processed.get(["update:2"]) == "2"
+
+    cat_id = db.create_category("Food", db_file)
+    db.add_transaction(1.0, cat_id, "expense", db_path=db_file, processed_keys=["update:9"])
+    expired = ProcessedUpdates(db_file, ttl=timedelta(seconds=-1))
+    assert expired.get(["update:9"]) is None
+    assert db.load_processed_updates(datetime(2000, 1, 1), 10, db_file) == []
+
+
+def test_expired_keys_are_purged_while_running(tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    cat_id = db.create_category("Food", db_file)
+    processed = ProcessedUpdates(db_file, ttl=timedelta(hours=1), purge_interval=timedelta(0))
+    old = datetime.utcnow() - timedelta(hours=2)
+    with db.connect(db_file) as conn:
+        conn.execute("INSERT INTO processed_updates VALUES ('update:1', '', ?)", (old.isoformat(),))
+
+    db.add_transaction(1.0, cat_id, "expense", db_path=db_file, processed_keys=["update:2"])
+    processed.remember(["update:2"], "Готово!")
+    processed.purge_expired()
+    keys = [row["key"] for row in db.load_processed_updates(datetime(2000, 1, 1), 10, db_file)]
+    assert keys == ["update:2"]
+
+
+def test_update_keys():
+    update = SimpleNamespace(update_id=10, message=SimpleNamespace(chat_id=3, message_id=4))
+    assert update_keys(update) == ["update:10", "message:3:4"]
@@ -1,4 +1,6 @@
+import asyncio
 import json
+import time
 
 import llm
 import db
@@ -9,7 +11,7 @@ def test_classify_and_add_creates_category(monkeypatch, tmp_path):
     db.init_db(db_file)
     monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
 
-    def fake_post(url, headers=None, json=None, timeout=None):
+    async def fake_post(url, headers=None, json=None, timeout=None):
         assert url == llm.OPENROUTER_URL
         class Resp:
             def json(self):
@@ -22,10 +24,110 @@ def test_classify_and_add_creates_category(monkeypatch, tmp_path):
                 pass
         return Resp()
 
-    monkeypatch.setattr(llm.httpx, "post", fake_post)
+    monkeypatch.setattr(llm, "_post", fake_post)
 
-    result = llm.classify_and_add("купил обед на 100", db_file)
-    assert result == {"category": "Еда", "amount": 100.0, "type": "expense"}
+    result = asyncio.run(llm.classify_and_add("купил обед на 100", db_file))
+    assert result == {"category": "Еда", "amount": 100.0, "type": "expense", "alerts": []}
     cats = db.list_categories(db_file)
     assert cats[0]["name"] == "Еда"
     assert db.get_balance(db_file) == -100.0
+
+
+def _response(content):
+    class Resp:
+        def json(self):
+            return {"choices": [{"message": {"content": content}}]}
+
+        def raise_for_status(self):
+            pass
+
+    return Resp()
+
+
+def test_slow_primary_is_hedged_with_fast_model(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    router = llm.ModelRouter(["slow", "fast"], budget=0.05)
+    monkeypatch.setattr(llm, "router", router)
+    cancelled = []
+
+    async def fake_post(url, headers=None, json=None, timeout=None):
+        if json["model"] == "slow":
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(json["model"])
+                raise
+            return _response('{"category": "Медленно", "type": "expense", "amount": 1}')
+        return _response('{"category": "Такси", "type": "expense", "amount": 300}')
+
+    monkeypatch.setattr(llm, "_post", fake_post)
+
+    start = time.monotonic()
+    result = asyncio.run(llm.classify_and_add("такси 300", db_file))
+    assert time.monotonic() - start < 1
+    assert result == {"category": "Такси", "amount": 300.0, "type": "expense", "alerts": []}
+    assert cancelled == ["slow"]
+    assert router.stats["fast"].successes == 1
+
+
+def test_cancelled_losers_do_not_slow_later_requests():
+    router = llm.ModelRouter(["slow", "fast"], budget=0.02)
+
+    async def call(model):
+        await asyncio.sleep(3 if model == "slow" else 0.01)
+        return {"model": model}
+
+    async def burst():
+        durations = []
+        for _ in range(6):
+            start = time.monotonic()
+            assert (await router.run(call))["model"] == "fast"
+            durations.append(time.monotonic() - start)
+        return durations
+
+    assert max(asyncio.run(burst())) < 0.5
+
+
+def test_cancelled_loser_is_recorded_as_slow():
+    router = llm.ModelRouter(["slow", "fast"], budget=0.02)
+
+    async def call(model):
+        await asyncio.sleep(3 if model == "slow" else 0.01)
+        return {"model": model}
+
+    asyncio.run(router.run(call))
+    slow = router.stats["slow"]
+    assert slow.calls == 1 and slow.successes == 0
+    assert slow.latency >= 0.02
+    assert router.ordered() == ["fast", "slow"]
+
+
+def test_invalid_answer_falls_through_and_drives_routing(monkeypatch):
+    router = llm.ModelRouter(["broken", "good"], budget=5)
+
+    async def call(model):
+        if model == "broken":
+            return llm._parse_result('{"category": "", "type": "expense", "amount": 1}')
+        return llm._parse_result('{"category": "Еда", "type": "expense", "amount": 5}')
+
+    assert asyncio.run(router.run(call))["category"] == "Еда"
+    assert router.stats["broken"].calls == 1 and router.stats["broken"].successes == 0
+    assert router.ordered() == ["good", "broken"]
+
+
+def test_classify_and_add_reports_budget_alerts(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    db.init_db(db_file)
+    cat_id = db.create_category("Еда", db_file)
+    db.set_budget(cat_id, 100.0, db_file)
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+
+    async def fake_post(url, headers=None, json=None, timeout=None):
+        return _response('{"category": "Еда", "type": "expense", "amount": 120}')
+
+    monkeypatch.setattr(llm, "_post", fake_post)
+
+    result = asyncio.run(llm.classify_and_add("обед 120", db_file))
+    assert result["alerts"] == [{"category": "Еда", "threshold": 1.0, "spent": 120.0, "limit": 100.0}]
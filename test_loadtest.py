@@ -0,0 +1,79 @@
+import asyncio
+
+import llm
+import telegram_bot
+from loadtest import FLOWS, format_report, percentile, run_load
+
+
+def test_run_load_reports_every_flow():
+    report = asyncio.run(
+        run_load(users=5, sessions=30, rate=1000, telegram_latency=0, llm_latency=0, stt_latency=0)
+    )
+    assert report["sessions"] == 30
+    assert report["steps"] == sum(row["steps"] for row in report["flows"].values())
+    assert set(report["flows"]) <= set(FLOWS)
+    assert all(row["errors"] == 0 for row in report["flows"].values())
+    assert report["upstream"]["telegram"]["calls"] >= report["steps"]
+    assert "updates/s" in format_report(report)
+    # fakes are removed again
+    assert not hasattr(telegram_bot.transcribe, "upstream")
+    assert not hasattr(llm._post, "upstream")
+
+
+def test_run_load_counts_upstream_errors():
+    report = asyncio.run(
+        run_load(users=2, sessions=5, rate=1000, mix={"voice": 1}, stt_latency=0, stt_errors=1.0)
+    )
+    assert report["flows"]["voice"]["error_rate"] == 1.0
+    assert report["upstream"]["transcription"]["errors"] == 5
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile([3, 1, 2, 4], 0.5) == 2
+    assert percentile([3, 1, 2, 4], 0.99) == 4
+
+
+def test_queueing_behind_a_slow_session_counts_as_latency():
+    # one user, five back-to-back sessions: the last waits for the four before it
+    report = asyncio.run(
+        run_load(
+            users=1, sessions=5, rate=1000, mix={"free_text": 1},
+            telegram_latency=0, llm_latency=0.05,
+        )
+    )
+    assert report["flows"]["free_text"]["p99"] >= 0.2
+    assert report["offered_rate"] > report["achieved_rate"]
+
+
+def test_run_load_through_cluster_workers():
+    report = asyncio.run(
+        run_load(
+            users=4, sessions=8, rate=1000, workers=2,
+            telegram_latency=0, llm_latency=0, stt_latency=0,
+        )
+    )
+    assert report["steps"] == sum(row["steps"] for row in report["flows"].values())
+    assert all(row["errors"] == 0 for row in report["flows"].values())
+    assert "upstream" not in report
+
+
+def test_in_process_mode_handles_one_update_at_a_time_like_run_polling():
+    # ten users at once, but the application's update processor runs them in turn
+    report = asyncio.run(
+        run_load(
+            users=10, sessions=10, rate=1000, mix={"free_text": 1},
+            telegram_latency=0, llm_latency=0.05,
+        )
+    )
+    assert report["flows"]["free_text"]["p99"] >= 0.2
+
+
+def test_fallback_reply_after_llm_failure_counts_as_error():
+    report = asyncio.run(
+        run_load(
+            users=3, sessions=6, rate=1000, mix={"free_text": 1},
+            telegram_latency=0, llm_latency=0, llm_errors=1.0,
+        )
+    )
+    assert report["flows"]["free_text"]["error_rate"] == 1.0
@@ -0,0 +1,24 @@
+from prompts import build_prompt, estimate_tokens, rank_categories
+
+
+def test_rank_prefers_similar_then_frequent():
+    usage = [("Еда", 50), ("Такси", 1), ("Кино", 0)]
+    assert rank_categories("поездка на такси 300", usage, k=2) == ["Такси", "Еда"]
+    # nothing matches: the most used categories come first
+    assert rank_categories("12345", usage, k=1) == ["Еда"]
+    assert rank_categories("что угодно", []) == []
+
+
+def test_build_prompt_respects_budget():
+    usage = [(f"Категория {i}", i) for i in range(500)]
+    full = ", ".join(name for name, _ in usage)
+    prompt = build_prompt("купил кофе", usage, budget=200)
+    assert estimate_tokens(prompt) <= 200
+    assert estimate_tokens(prompt) < estimate_tokens(full)
+    assert "Категория 499" in prompt
+    assert prompt.endswith("купил кофе")
+
+
+def test_build_prompt_without_categories():
+    assert "нет категорий" in build_prompt("купил кофе", [])
+    assert "нет категорий" in build_prompt("купил кофе", [("Еда", 1)], budget=1)
@@ -2,8 +2,12 @@ import asyncio
 from unittest.mock import AsyncMock, MagicMock
 
 import asyncio
+import subprocess
+import sys
+from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock
 
+from idempotency import update_keys
 from telegram_bot import MAIN_KEYBOARD, create_application
 import telegram_bot
 import db
@@ -69,6 +73,7 @@ def test_add_income_flow(monkeypatch, tmp_path):
     assert context.user_data == {}
     assert reply.call_args.kwargs["reply_markup"] is MAIN_KEYBOARD
     assert db.get_balance(db_file) == 100.0
+    assert [r["note"] for r in db.search_transactions("salary", db_path=db_file)] == ["Salary"]
 
 
 def test_month_report_flow(monkeypatch, tmp_path):
@@ -116,7 +121,7 @@ def test_voice_message_transcribed(monkeypatch, tmp_path):
     fake_text = "потратил 20 на еду"
     transcribe = AsyncMock(return_value=fake_text)
     monkeypatch.setattr(telegram_bot, "transcribe", transcribe)
-    classify = MagicMock(return_value={"category": "Food", "amount": 20.0, "type": "expense"})
+    classify = AsyncMock(return_value={"category": "Food", "amount": 20.0, "type": "expense"})
     monkeypatch.setattr(telegram_bot, "classify_and_add", classify)
 
     app = create_application()
@@ -142,7 +147,7 @@ def test_voice_message_transcribed(monkeypatch, tmp_path):
     asyncio.run(voice_handler.callback(update, context))
 
     transcribe.assert_called_once()
-    classify.assert_called_once_with(fake_text, db_file)
+    classify.assert_awaited_once_with(fake_text, db_file, update_keys(update))
     update.message.reply_text.assert_called_once()
     assert "Food" in update.message.reply_text.call_args.args[0]
 
@@ -190,3 +195,163 @@ def test_category_management_flow(monkeypatch, tmp_path):
     asyncio.run(call("Groceries"))
     assert context.user_data == {}
     assert db.list_categories(db_file) == []
+
+
+def test_redelivered_update_is_not_recorded_twice(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    monkeypatch.setenv("TELEGRAM_TOKEN", "TOKEN123")
+    monkeypatch.setattr(db, "DB_PATH", db_file)
+    monkeypatch.setattr(telegram_bot, "DB_PATH", db_file)
+    db.init_db(db_file)
+
+    classify = AsyncMock(return_value={"category": "Food", "amount": 20.0, "type": "expense"})
+    monkeypatch.setattr(telegram_bot, "classify_and_add", classify)
+
+    app = create_application()
+    handler = app.handlers[0][1]
+
+    context = MagicMock()
+    context.user_data = {}
+
+    async def call(text: str):
+        update = MagicMock()
+        update.update_id = 42
+        update.message = MagicMock()
+        update.message.chat_id = 1
+        update.message.message_id = 7
+        update.message.text = text
+        update.message.reply_text = AsyncMock()
+        await handler.callback(update, context)
+        return update.message.reply_text
+
+    first = asyncio.run(call("потратил 20 на еду"))
+    second = asyncio.run(call("потратил 20 на еду"))
+
+    classify.assert_called_once()
+    assert second.call_args.args[0] == first.call_args.args[0]
+    assert second.call_args.kwargs["reply_markup"] is MAIN_KEYBOARD
+
+
+def test_search_flow_pages_results(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    monkeypatch.setenv("TELEGRAM_TOKEN", "TOKEN123")
+    monkeypatch.setattr(db, "DB_PATH", db_file)
+    monkeypatch.setattr(telegram_bot, "DB_PATH", db_file)
+    db.init_db(db_file)
+    cat_id = db.create_category("Транспорт", db_file)
+    for i in range(telegram_bot.SEARCH_PAGE + 2):
+        db.add_transaction(100.0, cat_id, "expense", db_path=db_file, note=f"такси {i}")
+
+    app = create_application()
+    handler = app.handlers[0][1]
+
+    context = MagicMock()
+    context.user_data = {}
+
+    async def call(text: str):
+        update = MagicMock()
+        update.message = MagicMock()
+        update.message.text = text
+        update.message.reply_text = AsyncMock()
+        await handler.callback(update, context)
+        return update.message.reply_text
+
+    asyncio.run(call("Поиск 🔍"))
+    assert context.user_data["step"] == "search"
+
+    reply = asyncio.run(call("такси"))
+    first_page = reply.call_args.args[0]
+    assert f"Найдено: {telegram_bot.SEARCH_PAGE + 2}" in first_page
+    assert f"расходы: {100.0 * (telegram_bot.SEARCH_PAGE + 2):.2f}" in first_page
+    assert context.user_data["step"] == "search_more"
+
+    reply = asyncio.run(call(telegram_bot.MORE_BUTTON))
+    assert reply.call_args.args[0].count("такси") == 2
+    assert reply.call_args.kwargs["reply_markup"] is MAIN_KEYBOARD
+    assert context.user_data == {}
+
+
+def test_budget_alert_in_expense_reply(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    monkeypatch.setenv("TELEGRAM_TOKEN", "TOKEN123")
+    monkeypatch.setattr(db, "DB_PATH", db_file)
+    monkeypatch.setattr(telegram_bot, "DB_PATH", db_file)
+    db.init_db(db_file)
+    db.create_category("Food", db_file)
+
+    app = create_application()
+    handler = app.handlers[0][1]
+
+    context = MagicMock()
+    context.user_data = {}
+
+    async def call(text: str):
+        update = MagicMock()
+        update.message = MagicMock()
+        update.message.text = text
+        update.message.reply_text = AsyncMock()
+        await handler.callback(update, context)
+        return update.message.reply_text
+
+    asyncio.run(call("Лимит категории 🎯"))
+    assert context.user_data["step"] == "budget_select"
+    asyncio.run(call("Food"))
+    assert context.user_data["step"] == "budget_amount"
+    asyncio.run(call("100"))
+    assert context.user_data == {}
+
+    asyncio.run(call("Добавить расход 💸"))
+    asyncio.run(call("Food"))
+    reply = asyncio.run(call("85"))
+    text = reply.call_args.args[0]
+    assert text.startswith("Готово! Баланс: -85.00 ₽")
+    assert "⚠️ Food: 80% лимита (85.00 из 100.00 ₽)" in text
+
+    asyncio.run(call("Лимит категории 🎯"))
+    asyncio.run(call("Food"))
+    text = asyncio.run(call("50")).call_args.args[0]
+    assert text.startswith("Лимит 50.00 ₽ в месяц сохранён ✅")
+    assert "🚨 Food: 100% лимита (85.00 из 50.00 ₽)" in text
+
+
+def test_import_does_not_load_heavy_integrations():
+    code = (
+        "import sys, telegram_bot; "
+        "print(sorted(m for m in ('llm', 'speech', 'openai') if m in sys.modules))"
+    )
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=Path(__file__).parent,
+    )
+    assert out.stdout.strip() == "[]"
+
+
+def test_free_text_reply_includes_budget_alerts(monkeypatch, tmp_path):
+    db_file = tmp_path / "test.db"
+    monkeypatch.setenv("TELEGRAM_TOKEN", "TOKEN123")
+    monkeypatch.setattr(telegram_bot, "DB_PATH", db_file)
+    db.init_db(db_file)
+
+    alert = {"category": "Food", "threshold": 1.0, "spent": 120.0, "limit": 100.0}
+    classify = AsyncMock(
+        return_value={"category": "Food", "amount": 120.0, "type": "expense", "alerts": [alert]}
+    )
+    monkeypatch.setattr(telegram_bot, "classify_and_add", classify)
+
+    app = create_application()
+    handler = app.handlers[0][1]
+    context = MagicMock()
+    context.user_data = {}
+    update = MagicMock()
+    update.message = MagicMock()
+    update.message.text = "обед 120"
+    update.message.reply_text = AsyncMock()
+
+    asyncio.run(handler.callback(update, context))
+
+    text = update.message.reply_text.call_args.args[0]
+    assert text.startswith("120.00 ₽ в категории Food записано ✅")
+    assert "🚨 Food: 100% лимита (120.00 из 100.00 ₽)" in text